@@ -0,0 +1,1360 @@
+#!/usr/bin/env python3
+"""Copyright 2016 Mirantis, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may
+not use this file except in compliance with the License. You may obtain
+copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+License for the specific language governing permissions and limitations
+under the License.
+"""
+
+import argparse
+import atexit
+import datetime
+import io
+import itertools
+import json
+import logging as log
+import os
+import random
+import re
+import runpy
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from pyVmomi import SoapAdapter
+from pyVmomi import VmomiSupport
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+log.basicConfig(format='%(message)s', level=log.INFO)
+
+_victl = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'victl.py')
+
+_version = VmomiSupport.newestVersions.GetName('vim')
+_namespace = VmomiSupport.GetWsdlNamespace(_version)
+
+_collector = vmodl.query.PropertyCollector
+
+# methods which can be called without session
+_anonymous = {'RetrieveServiceContent', 'Login'}
+
+# performance counters as key, group, name, rollup, unit and stats type
+_perf_counters = [
+    (2, 'cpu', 'usage', 'average', 'percent', 'rate'),
+    (143, 'net', 'usage', 'average', 'kiloBytesPerSecond', 'rate'),
+    (146, 'net', 'packetsRx', 'summation', 'number', 'delta'),
+    (147, 'net', 'packetsTx', 'summation', 'number', 'delta'),
+    (148, 'net', 'received', 'average', 'kiloBytesPerSecond', 'rate'),
+    (149, 'net', 'transmitted', 'average', 'kiloBytesPerSecond', 'rate'),
+    (150, 'net', 'droppedRx', 'summation', 'number', 'delta'),
+    (151, 'net', 'droppedTx', 'summation', 'number', 'delta'),
+    (152, 'net', 'bytesRx', 'average', 'kiloBytesPerSecond', 'rate'),
+    (153, 'net', 'bytesTx', 'average', 'kiloBytesPerSecond', 'rate'),
+]
+
+
+def _session_key(cookie):
+    """Return session key from Cookie header, None if there is no session."""
+    match = re.search(r'{name}=\s*"?([^";\s]+)'.format(
+        name=SoapAdapter.COOKIE_NAME), cookie or '')
+    return match.group(1) if match else None
+
+
+def _vmodl_type(type_name):
+    """Return pyVmomi type by type or its WSDL name."""
+    if isinstance(type_name, type):
+        return type_name
+    return VmomiSupport.GetWsdlType(_namespace, type_name)
+
+
+def _array(item_type, items):
+    """Return typed array, plain lists can not be sent as anyType."""
+    return item_type.Array(list(items))
+
+
+def _perf_counter(key, group, name, rollup, unit, stats_type):
+    """Return description of performance counter."""
+    def description(label):
+        return vim.ElementDescription(key=label, label=label, summary=label)
+
+    return vim.PerformanceManager.CounterInfo(
+        key=key, nameInfo=description(name), groupInfo=description(group),
+        unitInfo=description(unit), rollupType=rollup, statsType=stats_type,
+        level=1, perDeviceLevel=3)
+
+
+def _typed_array(items):
+    """Return typed array of the most specific common type of items.
+
+    Arrays nested in data objects are plain lists, they get their type back
+    before they are sent as anyType. Empty lists are returned as None.
+    """
+    if not items:
+        return None
+    for item_type in type(items[0]).__mro__:
+        if hasattr(item_type, 'Array') and \
+                all(isinstance(item, item_type) for item in items):
+            return item_type.Array(items)
+    return items
+
+
+class FakeVCenter(object):
+    """vCenter which keeps the inventory in memory.
+
+    Managed objects are pyVmomi references without stub and their
+    properties are kept in dictionaries. Calls come from FakeStub with
+    arguments as pyVmomi objects and results go back as SOAP responses, so
+    the client deserializes them as it would do with real vCenter.
+    """
+
+    page_size = 100  # objects per RetrievePropertiesEx page by default
+    update_size = 100  # objects per WaitForUpdatesEx update set at most
+    task_time = 0.2  # seconds every task holds its entity
+    task_item_time = 0.02  # seconds per spec of multi-spec task
+    perf_interval = 20  # seconds between realtime performance samples
+    perf_samples = 180  # realtime samples kept, an hour by default
+
+    def __init__(self, user='administrator@vsphere.local',
+                 password='Qwer!1234', host='fake-vcenter'):
+        """Create vCenter with empty root folder."""
+        self.host = host
+        self.user = user
+        self.password = password
+        self.objects = {}  # moid: reference
+        self.props = {}  # moid: {property: value}
+        self.revisions = {}  # moid: number of the last change
+        self.files = {}  # (datacenter, datastore, path): data
+        self.netcpad = {}  # host name: connected to nsxv controller
+        self.dvports = {}  # dvSwitch moid: [DistributedVirtualPort]
+        self.sessions = {}  # session key: UserSession
+        self._children = {}
+        self._views = {}
+        self._filters = {}
+        self._collectors = {}
+        self._tokens = {}
+        self._owners = {}  # moid of collector, filter or view: session key
+        self._task_locks = {}
+        self._ids = itertools.count(1)
+        self._changes = threading.Condition()
+        self._call = threading.local()
+
+        self.service = self.add(vim.ServiceInstance, 'ServiceInstance')
+        self.root = self.add(vim.Folder, 'group-d1', name='Datacenters')
+        self.content = vim.ServiceInstanceContent(
+            rootFolder=self.root,
+            propertyCollector=self.add(_collector, 'propertyCollector'),
+            viewManager=self.add(vim.view.ViewManager, 'ViewManager'),
+            sessionManager=self.add(vim.SessionManager, 'SessionManager'),
+            perfManager=self.add(vim.PerformanceManager, 'PerfMgr',
+                                 perfCounter=[_perf_counter(*counter)
+                                              for counter in _perf_counters]),
+            about=vim.AboutInfo(
+                name='VMware vCenter Server', fullName='Fake vCenter Server',
+                vendor='VMware, Inc.', version='6.0.0', build='0',
+                osType='linux-x64', productLineId='vpx',
+                apiType='VirtualCenter', apiVersion='6.0',
+                instanceUuid=str(uuid.uuid4())))
+
+    def add(self, mo_type, moid=None, prefix=None, **props):
+        """Add managed object, return its reference.
+
+        :param moid: moid of object, it is generated from prefix if unset
+        """
+        moid = moid or '{prefix}{n}'.format(prefix=prefix, n=next(self._ids))
+        ref = mo_type(moid)
+        with self._changes:
+            self.objects[moid] = ref
+            self.props[moid] = {}
+            self._children[moid] = []
+        self.update(ref, **props)
+        return ref
+
+    def update(self, ref, **props):
+        """Change properties of managed object, collectors see the change."""
+        moid = ref._moId
+        with self._changes:
+            parent = props.get('parent', self.props[moid].get('parent'))
+            old_parent = self.props[moid].get('parent')
+            if old_parent is not None and old_parent is not parent:
+                self._children[old_parent._moId].remove(ref)
+            if parent is not None and parent is not old_parent:
+                self._children[parent._moId].append(ref)
+
+            self.props[moid].update(props)
+            self.revisions[moid] = next(self._ids)
+            self._changes.notify_all()
+
+    def remove(self, ref):
+        """Remove managed object with all its children."""
+        with self._changes:
+            for child in list(self._children.get(ref._moId, [])):
+                self.remove(child)
+            parent = self.props[ref._moId].get('parent')
+            if parent is not None:
+                self._children[parent._moId].remove(ref)
+            for table in (self.objects, self.props, self.revisions,
+                          self._children, self._owners):
+                table.pop(ref._moId, None)
+            self._changes.notify_all()
+
+    def find(self, mo_type, name):
+        """Return the first object of type with name."""
+        for moid, ref in self.objects.items():
+            if isinstance(ref, mo_type) and \
+                    self.props[moid].get('name') == name:
+                return ref
+        return None
+
+    def value(self, moid, path):
+        """Return value of property path of object.
+
+        :raise KeyError: if object has no such property
+        """
+        name, _, rest = path.partition('.')
+        if name == 'view' and moid in self._views:
+            value = self._view_objects(moid)
+        elif name == 'currentSession' and \
+                moid == self.content.sessionManager._moId:
+            value = self.sessions.get(self._call.session)
+        else:
+            value = self.props[moid][name]
+        for attr in rest.split('.') if rest else []:
+            value = getattr(value, attr)
+        if type(value) is list:
+            value = _typed_array(value)
+        if value is None:
+            raise KeyError(path)
+        return value
+
+    def invoke(self, moid, info, args, cookie):
+        """Call method of managed object.
+
+        :return: (HTTP status, SOAP response, Set-Cookie header or None)
+        """
+        self._call.cookie = None
+        self._call.session = _session_key(cookie)
+        try:
+            if moid not in self.objects:
+                raise vmodl.fault.ManagedObjectNotFound(
+                    obj=VmomiSupport.ManagedObject(moid))
+            if self._owners.get(moid, self._call.session) != \
+                    self._call.session:
+                raise vmodl.fault.ManagedObjectNotFound(
+                    obj=self.objects[moid])
+            if info.wsdlName not in _anonymous and \
+                    self._call.session not in self.sessions:
+                raise vim.fault.NotAuthenticated(
+                    object=self.objects[moid], privilegeId='System.View')
+            method = getattr(self, 'do_' + info.wsdlName, None)
+            if method is None:
+                raise vmodl.fault.NotImplemented()
+            result = method(moid, *args)
+        except vmodl.MethodFault as fault:
+            return 500, self._fault_response(fault), self._call.cookie
+        return 200, self._response(info, result), self._call.cookie
+
+    def _response(self, info, result):
+        """Return SOAP response with result of method."""
+        ns_map = dict(SoapAdapter.SOAP_NSMAP, **{_namespace: ''})
+        result_info = VmomiSupport.Object(name='returnval', type=info.result,
+                                          version=_version,
+                                          flags=info.resultFlags)
+        return ''.join([
+            SoapAdapter.XML_HEADER, '\n', SoapAdapter.SOAP_ENVELOPE_START,
+            SoapAdapter.SOAP_BODY_START,
+            '<{name}Response xmlns="{ns}">'.format(name=info.wsdlName,
+                                                   ns=_namespace),
+            SoapAdapter.SerializeToStr(result, result_info, _version, ns_map)
+            if result is not None else '',
+            '</{name}Response>'.format(name=info.wsdlName),
+            SoapAdapter.SOAP_BODY_END, SoapAdapter.SOAP_ENVELOPE_END,
+        ]).encode(SoapAdapter.XML_ENCODING)
+
+    def _fault_response(self, fault):
+        """Return SOAP response with fault."""
+        ns_map = dict(SoapAdapter.SOAP_NSMAP, **{_namespace: ''})
+        return ''.join([
+            SoapAdapter.XML_HEADER, '\n', SoapAdapter.SOAP_ENVELOPE_START,
+            SoapAdapter.SOAP_BODY_START,
+            '<{tag}><faultcode>ServerFaultCode</faultcode>'
+            '<faultstring>{msg}</faultstring><detail>'.format(
+                tag=SoapAdapter.SOAP_FAULT_TAG,
+                msg=SoapAdapter.XmlEscape(fault.msg or type(fault).__name__)),
+            SoapAdapter.SerializeFaultDetail(
+                fault, VmomiSupport.Object(name=fault._wsdlName + 'Fault',
+                                           type=object, version=_version,
+                                           flags=0), _version, ns_map),
+            '</detail></{tag}>'.format(tag=SoapAdapter.SOAP_FAULT_TAG),
+            SoapAdapter.SOAP_BODY_END, SoapAdapter.SOAP_ENVELOPE_END,
+        ]).encode(SoapAdapter.XML_ENCODING)
+
+    # ServiceInstance and SessionManager
+
+    def do_RetrieveServiceContent(self, moid):
+        """Return service content."""
+        return self.content
+
+    def do_CurrentTime(self, moid):
+        """Return current time of vCenter."""
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def do_Login(self, moid, userName, password, locale=None):
+        """Start session, its key is returned in cookie."""
+        if (userName, password) != (self.user, self.password):
+            raise vim.fault.InvalidLogin()
+        key = str(uuid.uuid4())
+        self._call.cookie = '{name}="{key}"; Path=/; HttpOnly; Secure;' \
+                            ''.format(name=SoapAdapter.COOKIE_NAME, key=key)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.sessions[key] = vim.UserSession(
+            key=key, userName=userName, fullName=userName, loginTime=now,
+            lastActiveTime=now, locale='en', messageLocale='en',
+            extensionSession=False, ipAddress='127.0.0.1',
+            userAgent='pyvmomi', callCount=0)
+        return self.sessions[key]
+
+    def do_Logout(self, moid):
+        """End session of the caller with its collectors and views."""
+        session = self._call.session
+        self.sessions.pop(session, None)
+        for owned, owner in list(self._owners.items()):
+            if owner != session or owned not in self.objects:
+                continue
+            if owned in self._collectors:
+                self.do_DestroyPropertyCollector(owned)
+            elif owned in self._views:
+                self.do_DestroyView(owned)
+            elif owned in self._filters:
+                self.do_DestroyPropertyFilter(owned)
+
+    def _own(self, ref):
+        """Make object private to the session of the caller."""
+        self._owners[ref._moId] = self._call.session
+        return ref
+
+    def do_Fetch(self, moid, prop):
+        """Return property of managed object, it is used by accessors."""
+        try:
+            return self.value(moid, prop)
+        except (KeyError, AttributeError):
+            return None
+
+    # ViewManager and views
+
+    def do_CreateContainerView(self, moid, container, type, recursive):
+        """Create view of objects of types in container."""
+        view = self._own(self.add(vim.view.ContainerView,
+                                  prefix='session[view]-'))
+        self._views[view._moId] = (container._moId,
+                                   tuple(_vmodl_type(name)
+                                         for name in type or ()),
+                                   recursive)
+        return view
+
+    def do_CreateListView(self, moid, obj=None):
+        """Create view of listed objects."""
+        view = self._own(self.add(vim.view.ListView,
+                                  prefix='session[view]-'))
+        self._views[view._moId] = []
+        self.do_ModifyListView(view._moId, obj)
+        return view
+
+    def do_ModifyListView(self, moid, add=None, remove=None):
+        """Change objects of list view, return ones which do not exist."""
+        listed = self._views[moid]
+        unresolved = []
+        for ref in add or []:
+            if ref._moId not in self.objects:
+                unresolved.append(ref)
+            elif ref._moId not in listed:
+                listed.append(ref._moId)
+        for ref in remove or []:
+            if ref._moId in listed:
+                listed.remove(ref._moId)
+        self.update(self.objects[moid])
+        if unresolved:
+            return _array(VmomiSupport.ManagedObject, unresolved)
+        return None
+
+    def do_DestroyView(self, moid):
+        """Destroy view."""
+        self._views.pop(moid, None)
+        self.remove(self.objects[moid])
+
+    def _view_objects(self, moid):
+        """Return objects in container or list view."""
+        if isinstance(self._views[moid], list):
+            return _array(VmomiSupport.ManagedObject, [
+                self.objects[obj] for obj in self._views[moid]
+                if obj in self.objects])
+        container, types, recursive = self._views[moid]
+        objects = []
+        queue = list(self._children.get(container, []))
+        while queue:
+            ref = queue.pop(0)
+            if not types or isinstance(ref, types):
+                objects.append(ref)
+            if recursive:
+                queue.extend(self._children.get(ref._moId, []))
+        return _array(VmomiSupport.ManagedObject, objects)
+
+    # PropertyCollector
+
+    def _select(self, object_specs):
+        """Return moids of objects selected by object specs."""
+        selected = []
+        seen = set()
+
+        def visit(ref, skip, select_set, named, path):
+            if not skip and ref._moId not in seen:
+                seen.add(ref._moId)
+                selected.append(ref._moId)
+            for spec in select_set or []:
+                spec = named.get(spec.name, spec) \
+                    if not isinstance(spec, _collector.TraversalSpec) \
+                    else spec
+                if not isinstance(spec, _collector.TraversalSpec) or \
+                        not isinstance(ref, _vmodl_type(spec.type)) or \
+                        (ref._moId, spec.name, spec.path) in path:
+                    continue
+                try:
+                    values = self.value(ref._moId, spec.path)
+                except (KeyError, AttributeError):
+                    continue
+                if not isinstance(values, list):
+                    values = [values]
+                for child in values:
+                    if isinstance(child, VmomiSupport.ManagedObject) and \
+                            child._moId in self.objects:
+                        visit(child, spec.skip, spec.selectSet, named,
+                              path | {(ref._moId, spec.name, spec.path)})
+
+        for obj_spec in object_specs:
+            named = {}
+            queue = list(obj_spec.selectSet or [])
+            while queue:
+                spec = queue.pop()
+                if isinstance(spec, _collector.TraversalSpec):
+                    if spec.name and spec.name not in named:
+                        named[spec.name] = spec
+                        queue.extend(spec.selectSet or [])
+            if obj_spec.obj._moId not in self.objects:
+                raise vmodl.fault.ManagedObjectNotFound(obj=obj_spec.obj)
+            visit(obj_spec.obj, obj_spec.skip, obj_spec.selectSet, named,
+                  frozenset())
+        return selected
+
+    def _paths(self, moid, prop_specs):
+        """Return property paths of object requested by property specs."""
+        ref = self.objects[moid]
+        paths = []
+        for spec in prop_specs:
+            if not isinstance(ref, _vmodl_type(spec.type)):
+                continue
+            names = sorted(self.props[moid]) if spec.all else spec.pathSet
+            paths.extend(name for name in names or []
+                         if name not in paths)
+        return paths
+
+    def _properties(self, moid, paths):
+        """Return dynamic properties of object, missing ones are skipped."""
+        props = []
+        for path in paths:
+            try:
+                value = self.value(moid, path)
+            except (KeyError, AttributeError):
+                continue
+            props.append(vmodl.DynamicProperty(name=path, val=value))
+        return props
+
+    def _contents(self, spec_set):
+        """Return object contents selected by filter specs."""
+        contents = []
+        with self._changes:
+            for spec in spec_set:
+                for moid in self._select(spec.objectSet):
+                    paths = self._paths(moid, spec.propSet)
+                    contents.append(_collector.ObjectContent(
+                        obj=self.objects[moid],
+                        propSet=self._properties(moid, paths)))
+        return contents
+
+    def _page(self, contents, size):
+        """Return first page of contents, the rest is kept under token."""
+        token = None
+        if len(contents) > size:
+            token = str(next(self._ids))
+            self._tokens[token] = (contents[size:], size)
+        if not contents:
+            return None
+        return _collector.RetrieveResult(token=token,
+                                         objects=contents[:size])
+
+    def do_RetrieveProperties(self, moid, specSet):
+        """Return all object contents at once."""
+        return self._contents(specSet)
+
+    def do_RetrievePropertiesEx(self, moid, specSet, options):
+        """Return the first page of object contents."""
+        return self._page(self._contents(specSet),
+                          options.maxObjects or self.page_size)
+
+    def do_ContinueRetrievePropertiesEx(self, moid, token):
+        """Return the next page of object contents."""
+        if token not in self._tokens:
+            raise vmodl.fault.InvalidArgument(invalidProperty='token')
+        return self._page(*self._tokens.pop(token))
+
+    def do_CancelRetrievePropertiesEx(self, moid, token):
+        """Drop the rest of object contents."""
+        self._tokens.pop(token, None)
+
+    def do_CreatePropertyCollector(self, moid):
+        """Create property collector of session."""
+        collector = self._own(self.add(_collector,
+                                       prefix='session[collector]-'))
+        self._collectors[collector._moId] = {'filters': [], 'version': 0}
+        return collector
+
+    def do_DestroyPropertyCollector(self, moid):
+        """Destroy property collector with its filters."""
+        for ref in self._collectors.pop(moid, {'filters': []})['filters']:
+            self._filters.pop(ref._moId, None)
+            self.remove(ref)
+        self.remove(self.objects[moid])
+
+    def do_CreateFilter(self, moid, spec, partialUpdates):
+        """Create filter of property collector."""
+        if moid not in self._collectors:
+            self._collectors[moid] = {'filters': [], 'version': 0}
+        ref = self._own(self.add(_collector.Filter,
+                                 prefix='session[filter]-'))
+        self._filters[ref._moId] = {'spec': spec, 'seen': {}}
+        self._collectors[moid]['filters'].append(ref)
+        return ref
+
+    def do_DestroyPropertyFilter(self, moid):
+        """Destroy filter."""
+        self._filters.pop(moid, None)
+        for collector in self._collectors.values():
+            if self.objects[moid] in collector['filters']:
+                collector['filters'].remove(self.objects[moid])
+        self.remove(self.objects[moid])
+
+    def _filter_update(self, ref, limit=None):
+        """Return changes of objects seen by filter since the last call.
+
+        :param limit: maximum number of object updates, the rest is left
+                      for the next call
+        :return: (FilterUpdate or None, True if some updates are left)
+        """
+        state = self._filters[ref._moId]
+        spec = state['spec']
+        current = {moid: self.revisions[moid]
+                   for moid in self._select(spec.objectSet)}
+        pending = [moid for moid, revision in sorted(current.items())
+                   if state['seen'].get(moid) != revision]
+        pending += sorted(set(state['seen']) - set(current))
+
+        updates = []
+        for moid in pending[:limit]:
+            if moid not in current:
+                del state['seen'][moid]
+                updates.append(_collector.ObjectUpdate(
+                    kind='leave', obj=VmomiSupport.ManagedObject(moid)))
+                continue
+            kind = 'modify' if moid in state['seen'] else 'enter'
+            changes = [_collector.Change(name=prop.name, op='assign',
+                                         val=prop.val)
+                       for prop in self._properties(
+                           moid, self._paths(moid, spec.propSet))]
+            updates.append(_collector.ObjectUpdate(
+                kind=kind, obj=self.objects[moid], changeSet=changes))
+            state['seen'][moid] = current[moid]
+
+        truncated = limit is not None and len(pending) > limit
+        if updates:
+            return (_collector.FilterUpdate(filter=ref, objectSet=updates),
+                    truncated)
+        return None, truncated
+
+    def do_WaitForUpdatesEx(self, moid, version=None, options=None):
+        """Return changes since version, wait for them if there are none.
+
+        Update set holds at most update_size or maxObjectUpdates objects,
+        it is truncated when more changes are left. Version must be empty
+        or the last one returned.
+        """
+        collector = self._collectors.get(moid)
+        if collector is None:
+            return None
+        if version and version != str(collector['version']):
+            raise vmodl.query.InvalidCollectorVersion()
+        wait = options.maxWaitSeconds if options else None
+        deadline = None if wait is None else time.time() + wait
+        limit = min(self.update_size,
+                    getattr(options, 'maxObjectUpdates', None) or
+                    self.update_size)
+
+        with self._changes:
+            if not version:
+                for ref in collector['filters']:
+                    self._filters[ref._moId]['seen'] = {}
+            while True:
+                updates = []
+                truncated = False
+                for ref in collector['filters']:
+                    update, left = self._filter_update(ref, limit)
+                    if update:
+                        updates.append(update)
+                        limit -= len(update.objectSet)
+                    truncated = truncated or left
+                if updates:
+                    collector['version'] += 1
+                    return _collector.UpdateSet(
+                        version=str(collector['version']),
+                        filterSet=updates, truncated=truncated)
+                timeout = None if deadline is None else deadline - time.time()
+                if timeout is not None and timeout <= 0:
+                    return None
+                self._changes.wait(timeout)
+
+    # DistributedVirtualSwitch
+
+    def _dv_ports(self, moid, criteria):
+        """Yield ports of dvSwitch which match criteria."""
+        if criteria and (criteria.scope or criteria.nsxPort is not None):
+            raise vmodl.fault.NotImplemented()
+        hosts = {host._moId for host in criteria.host or []} \
+            if criteria else set()
+        uplink_keys = {pg._moId for pg in self.props[moid]['config']
+                       .uplinkPortgroup or []}
+        for port in self.dvports.get(moid, []):
+            if criteria is None:
+                yield port
+                continue
+            if criteria.portKey and port.key not in criteria.portKey:
+                continue
+            if criteria.portgroupKey and \
+                    (port.portgroupKey in criteria.portgroupKey) != \
+                    (criteria.inside is not False):
+                continue
+            if criteria.connected is not None and \
+                    bool(port.connectee) != criteria.connected:
+                continue
+            if criteria.active is not None and \
+                    port.state.runtimeInfo.linkUp != criteria.active:
+                continue
+            if criteria.uplinkPort is not None and \
+                    (port.portgroupKey in uplink_keys) != criteria.uplinkPort:
+                continue
+            if hosts and getattr(port.proxyHost, '_moId', None) not in hosts:
+                continue
+            yield port
+
+    def do_FetchDVPortKeys(self, moid, criteria=None):
+        """Return keys of ports which match criteria."""
+        return VmomiSupport.GetVmodlType('string[]')(
+            port.key for port in self._dv_ports(moid, criteria))
+
+    def do_FetchDVPorts(self, moid, criteria=None):
+        """Return ports which match criteria."""
+        return _array(vim.dvs.DistributedVirtualPort,
+                      self._dv_ports(moid, criteria))
+
+    def do_AddDVPortgroup_Task(self, moid, spec):
+        """Start task which adds portgroups to dvSwitch."""
+        dvs = self.objects[moid]
+
+        def add_portgroups():
+            names = {self.props[pg._moId]['name']
+                     for pg in self.props[moid]['portgroup']}
+            for pg_spec in spec:
+                if pg_spec.name in names:
+                    raise vim.fault.DuplicateName(
+                        name=pg_spec.name, object=dvs)
+                names.add(pg_spec.name)
+            config = self.props[moid]['config']
+            hosts = [member.config.host for member in config.host]
+            added = []
+            for pg_spec in spec:
+                pg = self.add(vim.dvs.DistributedVirtualPortgroup,
+                              prefix='dvportgroup-', name=pg_spec.name,
+                              parent=self.props[moid]['parent'])
+                pg_config = _portgroup_config(
+                    self, pg, dvs, config.uplinkPortPolicy.uplinkPortName, 0,
+                    pg_spec.numPorts or 0)
+                if pg_spec.defaultPortConfig:
+                    pg_config.defaultPortConfig = pg_spec.defaultPortConfig
+                self.update(pg, key=pg._moId, config=pg_config,
+                            host=_array(vim.HostSystem, hosts))
+                added.append(pg)
+            self._attach_networks(dvs, hosts, added)
+
+        return self._start_task(dvs, 'AddPortgroup', add_portgroups,
+                                len(spec))
+
+    def do_Destroy_Task(self, moid):
+        """Start task which destroys portgroup."""
+        pg = self.objects[moid]
+        if not isinstance(pg, vim.dvs.DistributedVirtualPortgroup):
+            raise vmodl.fault.NotImplemented()
+        dvs = self.props[moid]['config'].distributedVirtualSwitch
+
+        def destroy():
+            self._detach_networks(dvs, pg)
+            self.dvports[dvs._moId] = [
+                port for port in self.dvports.get(dvs._moId, [])
+                if port.portgroupKey != moid]
+            self.remove(pg)
+
+        return self._start_task(pg, 'Destroy', destroy, lock=dvs)
+
+    def _attach_networks(self, dvs, hosts, networks):
+        """Add networks to dvSwitch, hosts and their clusters."""
+        folder = self.props[dvs._moId]['parent']
+        entities = [dvs, self.props[folder._moId]['parent']] + hosts + \
+            list({self.props[esxi._moId]['parent'] for esxi in hosts})
+        for entity in entities:
+            prop = 'portgroup' if entity is dvs else 'network'
+            current = list(self.props[entity._moId].get(prop) or [])
+            self.update(entity, **{prop: _array(
+                type(networks[0]) if entity is dvs else vim.Network,
+                current + networks)})
+
+    def _detach_networks(self, dvs, network):
+        """Remove network from dvSwitch and all hosts and clusters."""
+        for moid, props in list(self.props.items()):
+            prop = 'portgroup' if moid == dvs._moId else 'network'
+            current = props.get(prop) or []
+            if network in current:
+                self.update(self.objects[moid], **{prop: _array(
+                    vim.dvs.DistributedVirtualPortgroup if prop == 'portgroup'
+                    else vim.Network,
+                    [item for item in current if item != network])})
+
+    # Tasks
+
+    def _start_task(self, entity, name, work, items=1, lock=None):
+        """Return task which runs work in background.
+
+        Tasks which lock the same entity run one by one, every task takes
+        task_time and task_item_time for every item.
+
+        :param lock: entity which task locks, the entity itself if unset
+        """
+        task = self.add(vim.Task, prefix='task-')
+        now = datetime.datetime.now(datetime.timezone.utc)
+        info = dict(key=task._moId, task=task, entity=entity,
+                    entityName=self.props[entity._moId].get('name'),
+                    descriptionId='{type}.{name}'.format(
+                        type=type(entity)._wsdlName, name=name),
+                    cancelled=False, cancelable=False,
+                    reason=vim.TaskReasonUser(userName=self.user),
+                    queueTime=now, eventChainId=next(self._ids))
+        self.update(task, info=vim.TaskInfo(state='queued', **info))
+        lock = self._task_locks.setdefault((lock or entity)._moId,
+                                           threading.Lock())
+
+        def run():
+            with lock:
+                info['startTime'] = datetime.datetime.now(
+                    datetime.timezone.utc)
+                self.update(task, info=vim.TaskInfo(state='running', **info))
+                time.sleep(self.task_time + self.task_item_time * items)
+                with self._changes:
+                    try:
+                        work()
+                        state = 'success'
+                    except vmodl.MethodFault as fault:
+                        info['error'] = fault
+                        state = 'error'
+                    info['completeTime'] = datetime.datetime.now(
+                        datetime.timezone.utc)
+                    self.update(task, info=vim.TaskInfo(state=state, **info))
+
+        threading.Thread(target=run, daemon=True).start()
+        return task
+
+    # PerformanceManager
+
+    def _perf_entity(self, entity):
+        """Raise fault if entity is unknown.
+
+        Virtual machines are only connectees of dvSwitch ports, any of them
+        has performance data.
+        """
+        if entity._moId not in self.objects and \
+                not isinstance(entity, vim.VirtualMachine):
+            raise vmodl.fault.ManagedObjectNotFound(obj=entity)
+
+    def do_QueryPerfProviderSummary(self, moid, entity):
+        """Return intervals of performance data of entity."""
+        self._perf_entity(entity)
+        return vim.PerformanceManager.ProviderSummary(
+            entity=entity, currentSupported=True, summarySupported=True,
+            refreshRate=self.perf_interval)
+
+    def do_QueryPerf(self, moid, querySpec):
+        """Return realtime samples of metrics for every query spec.
+
+        Samples are aligned to the realtime interval, the ones after
+        startTime are returned, the last maxSample of them if it is set.
+        Values are random, but the same for the same sample.
+        """
+        interval = self.perf_interval
+        last = int(time.time() // interval) * interval
+        stats = {counter[0]: counter[5] for counter in _perf_counters}
+        result = []
+        for spec in querySpec:
+            self._perf_entity(spec.entity)
+            if spec.intervalId != interval:
+                raise vmodl.fault.InvalidArgument(invalidProperty='intervalId')
+            first = last - interval * (self.perf_samples - 1)
+            if spec.startTime:
+                first = max(first, int(spec.startTime.timestamp() //
+                                       interval + 1) * interval)
+            stamps = list(range(first, last + 1, interval))
+            if spec.maxSample:
+                stamps = stamps[-spec.maxSample:]
+            if not stamps:
+                continue
+
+            def value(metric, stamp):
+                sample = random.Random('{moid}/{id}/{instance}/{stamp}'.format(
+                    moid=spec.entity._moId, id=metric.counterId,
+                    instance=metric.instance, stamp=stamp))
+                return sample.randint(0, 3) if \
+                    stats.get(metric.counterId) == 'delta' else \
+                    sample.randint(0, 125000)
+
+            result.append(vim.PerformanceManager.EntityMetric(
+                entity=spec.entity,
+                sampleInfo=[vim.PerformanceManager.SampleInfo(
+                    timestamp=datetime.datetime.fromtimestamp(
+                        stamp, datetime.timezone.utc),
+                    interval=interval) for stamp in stamps],
+                value=[vim.PerformanceManager.IntSeries(
+                    id=metric, value=[value(metric, stamp)
+                                      for stamp in stamps])
+                       for metric in spec.metricId or []]))
+        return _array(vim.PerformanceManager.EntityMetricBase, result)
+
+    # HTTP access to datastores
+
+    def http(self, method, url, cookie, headers, body):
+        """Handle request to /folder, return (status, headers, data)."""
+        if _session_key(cookie) not in self.sessions:
+            return 401, {}, b''
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        if not parts.path.startswith('/folder/'):
+            return 404, {}, b''
+        key = (query.get('dcPath', [''])[0], query.get('dsName', [''])[0],
+               parts.path[len('/folder/'):])
+        datacenter = self.find(vim.Datacenter, key[0])
+        if datacenter is None or key[1] not in [
+                self.props[ds._moId]['name']
+                for ds in self.props[datacenter._moId]['datastore']]:
+            return 404, {}, b''
+
+        if method == 'PUT':
+            if not isinstance(body, (bytes, str, type(None))):
+                body = b''.join(chunk if isinstance(chunk, bytes)
+                                else chunk.encode('utf-8') for chunk in body)
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            created = key not in self.files
+            self.files[key] = body or b''
+            return 201 if created else 200, {}, b''
+        if key not in self.files:
+            return 404, {}, b''
+        if method == 'DELETE':
+            del self.files[key]
+            return 204, {}, b''
+
+        data = self.files[key]
+        match = re.match(r'bytes=(\d+)-(\d*)$', headers.get('Range', ''))
+        if match:
+            first = int(match.group(1))
+            last = int(match.group(2) or len(data) - 1)
+            return 206, {'Content-Range': 'bytes {0}-{1}/{2}'.format(
+                first, last, len(data))}, data[first:last + 1]
+        return 200, {}, data
+
+    # SSH to ESXi
+
+    def ssh(self, host, cmd):
+        """Run command on host, return its output."""
+        if 'netcpad restart' in cmd:
+            self.netcpad[host] = True
+            return b''
+        if 'esxcli network ip connection list' in cmd:
+            if not self.netcpad.get(host):
+                return b''
+            return 'tcp 0 0 {host}:52123 192.168.0.2:1234 ESTABLISHED ' \
+                   '10 newreno netcpa-worker\n'.format(host=host).encode()
+        return b''
+
+
+class _FakeResponse(object):
+    """HTTP response with SOAP body."""
+
+    reason = 'OK'
+
+    def __init__(self, status, body, cookie):
+        """Keep response."""
+        self.status = status
+        self._body = io.BytesIO(body)
+        self._headers = {'Set-Cookie': cookie} if cookie else {}
+
+    def getheader(self, name, default=None):
+        """Return header of response."""
+        return self._headers.get(name, default)
+
+    def read(self, *args):
+        """Read body of response."""
+        return self._body.read(*args)
+
+
+class _FakeConnection(object):
+    """HTTP connection which passes requests to fake vCenter."""
+
+    def __init__(self, stub):
+        """Use pending calls of stub."""
+        self._stub = stub
+        self._response = None
+
+    def request(self, method, path, body, headers):
+        """Call fake vCenter, SOAP request is not parsed but measured."""
+        mo, info, args = self._stub._pending.call
+        self._response = _FakeResponse(*self._stub.vcenter.invoke(
+            mo._moId, info, args, headers.get('Cookie')))
+
+    def getresponse(self):
+        """Return response of the last request."""
+        return self._response
+
+    def close(self):
+        """Nothing to close."""
+
+
+class FakeStub(SoapAdapter.SoapStubAdapter):
+    """pyVmomi stub which calls fake vCenter instead of HTTP server.
+
+    Requests are serialized as usual and then passed to the fake vCenter
+    as pyVmomi objects, responses are real SOAP documents.
+    """
+
+    def __init__(self, vcenter):
+        """Create stub for vcenter."""
+        SoapAdapter.SoapStubAdapter.__init__(self, host=vcenter.host,
+                                             version=_version)
+        self.vcenter = vcenter
+        self._pending = threading.local()
+
+    def SerializeRequest(self, mo, info, args):
+        """Serialize request and remember the call for connection."""
+        self._pending.call = (mo, info, args)
+        return SoapAdapter.SoapStubAdapter.SerializeRequest(self, mo, info,
+                                                            args)
+
+    def GetConnection(self):
+        """Return connection to fake vCenter."""
+        return _FakeConnection(self)
+
+    def ReturnConnection(self, conn):
+        """Connections are not pooled."""
+
+    def DropConnections(self):
+        """Connections are not pooled."""
+
+
+class _FakeSSHClient(object):
+    """paramiko.SSHClient which runs commands on fake ESXi."""
+
+    def __init__(self, vcenters):
+        """Create client for hosts of vcenters."""
+        self._vcenters = vcenters
+        self._vcenter = None
+        self._host = None
+
+    def set_missing_host_key_policy(self, policy):
+        """All hosts are trusted."""
+
+    def connect(self, host, username=None, password=None, timeout=None):
+        """Check up that host is known to one of vCenters."""
+        for vcenter in self._vcenters:
+            if vcenter.find(vim.HostSystem, host) is not None:
+                self._vcenter = vcenter
+                self._host = host
+                return
+        raise socket.error('No route to host {host}'.format(host=host))
+
+    def get_transport(self):
+        """Return transport, it is active while client is connected."""
+        return self if self._host else None
+
+    def is_active(self):
+        """Return True if client is connected."""
+        return self._host is not None
+
+    def exec_command(self, cmd, timeout=None):
+        """Run command, return stdin, stdout and stderr."""
+        out = self._vcenter.ssh(self._host, cmd)
+        return io.BytesIO(), io.BytesIO(out), io.BytesIO()
+
+    def close(self):
+        """Disconnect."""
+        self._host = None
+
+
+def install(*vcenters):
+    """Make pyVim, paramiko and requests use vcenters instead of network.
+
+    Connections go to the vCenter with the same host name, the first
+    vCenter serves any other host name.
+    """
+    import paramiko
+    import requests
+    import requests.adapters
+    from pyVim import connect
+
+    by_host = {vcenter.host: vcenter for vcenter in vcenters}
+
+    def smart_connect(host=None, user=None, pwd=None, **kwargs):
+        service = vim.ServiceInstance('ServiceInstance', FakeStub(
+            by_host.get(host, vcenters[0])))
+        service.RetrieveContent().sessionManager.Login(user, pwd, None)
+        return service
+
+    class StubAdapter(FakeStub):
+        """Stub which is created for any host and talks to its vCenter."""
+
+        def __init__(self, host='localhost', *args, **kwargs):
+            FakeStub.__init__(self, by_host.get(host, vcenters[0]))
+
+    class Adapter(requests.adapters.BaseAdapter):
+        """Transport which sends requests to fake vCenter."""
+
+        def send(self, request, **kwargs):
+            vcenter = by_host.get(urlsplit(request.url).hostname,
+                                  vcenters[0])
+            status, headers, data = vcenter.http(
+                request.method, request.url, request.headers.get('Cookie'),
+                request.headers, request.body)
+            response = requests.Response()
+            response.status_code = status
+            response.headers.update(headers)
+            response.raw = io.BytesIO(data)
+            response.url = request.url
+            response.request = request
+            return response
+
+        def close(self):
+            pass
+
+    class Session(requests.Session):
+        """Session which talks to fake vCenter over https."""
+
+        def __init__(self):
+            super(Session, self).__init__()
+            self.mount('https://', Adapter())
+
+    connect.SmartConnect = smart_connect
+    connect.SoapStubAdapter = StubAdapter
+    paramiko.SSHClient = lambda: _FakeSSHClient(vcenters)
+    requests.Session = Session
+
+
+def generate(datacenters=1, clusters=1, hosts=10, portgroups=4,
+             datastores=2, uplinks=2, ports=8, vcenter=None):
+    """Return fake vCenter with synthetic inventory.
+
+    Every cluster has its own dvSwitch which is attached to all hosts of
+    cluster with one vmnic per uplink and has portgroups br100, br101 and
+    so on with VLAN of their number. Half of ports of every portgroup are
+    connected to virtual machines. Shared datastores are mounted on all
+    hosts of datacenter and every host has local one.
+
+    :param hosts: number of hosts in every cluster
+    :param portgroups: number of portgroups on every dvSwitch
+    :param datastores: number of shared datastores in every datacenter
+    :param uplinks: number of uplinks of every dvSwitch
+    :param ports: number of ports in every portgroup
+    """
+    vc = vcenter or FakeVCenter()
+    host_ids = itertools.count(1)
+    vm_ids = itertools.count(1)
+    portgroup_ids = itertools.count(100)
+    uplink_names = ['dvUplink{0}'.format(n + 1) for n in range(uplinks)]
+
+    for dc_index in range(datacenters):
+        dc = vc.add(vim.Datacenter, prefix='datacenter-', parent=vc.root,
+                    name='Datacenter{0}'.format(dc_index + 1)
+                    if dc_index else 'Datacenter')
+        folders = {}
+        for name, prefix in (('vm', 'group-v'), ('host', 'group-h'),
+                             ('datastore', 'group-s'),
+                             ('network', 'group-n')):
+            folders[name] = vc.add(vim.Folder, prefix=prefix, name=name,
+                                   parent=dc)
+
+        shared = [vc.add(vim.Datastore, prefix='datastore-',
+                         name='nfs{0}'.format(n + 1),
+                         parent=folders['datastore'])
+                  for n in range(datastores)]
+        vm_network = vc.add(vim.Network, prefix='network-', name='VM Network',
+                            parent=folders['network'])
+        dc_hosts = []
+        dc_datastores = list(shared)
+        dc_networks = [vm_network]
+
+        for cl_index in range(clusters):
+            cluster = vc.add(vim.ClusterComputeResource, prefix='domain-c',
+                             name='Cluster{0}'.format(cl_index + 1),
+                             parent=folders['host'])
+            cl_hosts = []
+            for _ in range(hosts):
+                name = 'esxi{0}'.format(next(host_ids))
+                esxi = vc.add(vim.HostSystem, prefix='host-', name=name,
+                              parent=cluster)
+                local = vc.add(vim.Datastore, prefix='datastore-',
+                               name='{0}-local'.format(name),
+                               parent=folders['datastore'])
+                vc.update(local, host=_array(vim.Datastore.HostMount, [
+                    _datastore_mount(local, esxi)]))
+                vc.update(esxi, datastore=_array(vim.Datastore,
+                                                 shared + [local]))
+                vc.netcpad[name] = True
+                cl_hosts.append(esxi)
+                dc_datastores.append(local)
+
+            dvs = vc.add(vim.dvs.VmwareDistributedVirtualSwitch, prefix='dvs-',
+                         name='dvSwitch{0}'.format(cl_index + 1),
+                         parent=folders['network'])
+            uplink_pg = vc.add(
+                vim.dvs.DistributedVirtualPortgroup, prefix='dvportgroup-',
+                name='dvSwitch{0}-DVUplinks'.format(cl_index + 1),
+                parent=folders['network'])
+            pgs = [uplink_pg]
+            vlans = {uplink_pg._moId: None}
+            for _ in range(portgroups):
+                vlan = next(portgroup_ids)
+                pg = vc.add(
+                    vim.dvs.DistributedVirtualPortgroup, prefix='dvportgroup-',
+                    name='br{0}'.format(vlan), parent=folders['network'])
+                pgs.append(pg)
+                vlans[pg._moId] = vlan
+            vc.update(dvs, uuid=str(uuid.uuid4()))
+            vc.dvports[dvs._moId] = _dvs_ports(vc, dvs, pgs, vlans, cl_hosts,
+                                               uplink_names, ports, vm_ids)
+            for pg in pgs:
+                vc.update(pg, key=pg._moId,
+                          host=_array(vim.HostSystem, cl_hosts),
+                          config=_portgroup_config(
+                              vc, pg, dvs, uplink_names, vlans[pg._moId],
+                              ports if vlans[pg._moId] else
+                              len(cl_hosts) * uplinks))
+            vc.update(dvs, portgroup=_array(
+                vim.dvs.DistributedVirtualPortgroup, pgs),
+                config=_dvs_config(vc, dvs, uplink_pg, cl_hosts,
+                                   uplink_names))
+
+            for esxi in cl_hosts:
+                vc.update(esxi, network=_array(vim.Network,
+                                               [vm_network] + pgs))
+            vc.update(cluster, host=_array(vim.HostSystem, cl_hosts),
+                      datastore=_array(vim.Datastore, shared),
+                      network=_array(vim.Network, [vm_network] + pgs))
+            dc_hosts.extend(cl_hosts)
+            dc_networks.extend(pgs)
+
+        for ds in shared:
+            vc.update(ds, host=_array(vim.Datastore.HostMount, [
+                _datastore_mount(ds, esxi) for esxi in dc_hosts]))
+        for ds in dc_datastores:
+            vc.update(ds, summary=vim.Datastore.Summary(
+                datastore=ds, name=vc.props[ds._moId]['name'],
+                url='ds:///vmfs/volumes/{0}/'.format(ds._moId),
+                capacity=2 ** 40, freeSpace=2 ** 39, type='NFS',
+                accessible=True))
+        vc.update(vm_network, host=_array(vim.HostSystem, dc_hosts))
+        vc.update(dc, hostFolder=folders['host'], vmFolder=folders['vm'],
+                  networkFolder=folders['network'],
+                  datastoreFolder=folders['datastore'],
+                  datastore=_array(vim.Datastore, dc_datastores),
+                  network=_array(vim.Network, dc_networks))
+    return vc
+
+
+def _datastore_mount(ds, esxi):
+    """Return mount of datastore on host."""
+    return vim.Datastore.HostMount(key=esxi, mountInfo=vim.host.MountInfo(
+        path='/vmfs/volumes/{0}'.format(ds._moId), accessMode='readWrite',
+        mounted=True, accessible=True))
+
+
+def _vlan_spec(vlan):
+    """Return VLAN setting, trunk of all VLANs if vlan is None."""
+    dvs_port = vim.dvs.VmwareDistributedVirtualSwitch
+    if vlan is None:
+        return dvs_port.TrunkVlanSpec(inherited=False, vlanId=[
+            vim.NumericRange(start=0, end=4094)])
+    return dvs_port.VlanIdSpec(inherited=False, vlanId=vlan)
+
+
+def _dvs_ports(vc, dvs, portgroups, vlans, hosts, uplink_names, ports,
+               vm_ids):
+    """Return ports of dvSwitch.
+
+    Uplink portgroup has a port per uplink of every host connected to its
+    vmnic. The first half of ports of other portgroups is connected to
+    virtual machines on hosts in turn and every other connected port is
+    up.
+    """
+    dvs_port = vim.dvs.DistributedVirtualPort
+    stats = vim.dvs.PortStatistics(**{
+        prop.name: 0 for prop in vim.dvs.PortStatistics._GetPropertyList()
+        if not prop.flags & VmomiSupport.F_OPTIONAL})
+    now = datetime.datetime.now(datetime.timezone.utc)
+    keys = itertools.count()
+
+    def port(pg, connectee, link_up, host=None):
+        return dvs_port(
+            key=str(next(keys)), portgroupKey=pg._moId, proxyHost=host,
+            dvsUuid=vc.props[dvs._moId]['uuid'], connectee=connectee,
+            conflict=False, lastStatusChange=now,
+            config=dvs_port.ConfigInfo(
+                configVersion='0',
+                setting=vim.dvs.VmwareDistributedVirtualSwitch
+                .VmwarePortConfigPolicy(vlan=_vlan_spec(vlans[pg._moId]))),
+            state=dvs_port.State(stats=stats, runtimeInfo=dvs_port
+                                 .RuntimeInfo(linkUp=link_up, blocked=False)))
+
+    result = []
+    for pg in portgroups:
+        if vlans[pg._moId] is None:
+            for esxi in hosts:
+                for n in range(len(uplink_names)):
+                    result.append(port(pg, vim.dvs.PortConnectee(
+                        connectedEntity=esxi, type='pnic',
+                        nicKey='vmnic{0}'.format(n + 1)), True, esxi))
+            continue
+        for n in range(ports):
+            connected = n < ports // 2
+            result.append(port(pg, vim.dvs.PortConnectee(
+                connectedEntity=vim.VirtualMachine(
+                    'vm-{0}'.format(next(vm_ids))),
+                type='vmVnic', nicKey='4000') if connected else None,
+                connected and n % 2 == 0,
+                hosts[n % len(hosts)] if connected and hosts else None))
+    return result
+
+
+def _portgroup_config(vc, pg, dvs, uplink_names, vlan, ports):
+    """Return config of portgroup with all uplinks active."""
+    dvs_port = vim.dvs.VmwareDistributedVirtualSwitch
+    teaming = dvs_port.UplinkPortTeamingPolicy(
+        inherited=False,
+        policy=vim.StringPolicy(inherited=False, value='loadbalance_srcid'),
+        uplinkPortOrder=dvs_port.UplinkPortOrderPolicy(
+            inherited=False, activeUplinkPort=list(uplink_names),
+            standbyUplinkPort=[]))
+    return vim.dvs.DistributedVirtualPortgroup.ConfigInfo(
+        key=pg._moId, name=vc.props[pg._moId]['name'], numPorts=ports,
+        distributedVirtualSwitch=dvs, type='earlyBinding',
+        defaultPortConfig=dvs_port.VmwarePortConfigPolicy(
+            vlan=_vlan_spec(vlan), uplinkTeamingPolicy=teaming))
+
+
+def _dvs_config(vc, dvs, uplink_pg, hosts, uplink_names):
+    """Return config of dvSwitch attached to hosts."""
+    member = vim.dvs.HostMember
+    members = [member(config=member.ConfigInfo(
+        host=esxi, backing=member.PnicBacking(pnicSpec=[
+            member.PnicSpec(pnicDevice='vmnic{0}'.format(n + 1),
+                            uplinkPortgroupKey=uplink_pg._moId)
+            for n in range(len(uplink_names))])))
+        for esxi in hosts]
+    return vim.dvs.VmwareDistributedVirtualSwitch.ConfigInfo(
+        uuid=vc.props[dvs._moId]['uuid'],
+        name=vc.props[dvs._moId]['name'], numPorts=0, maxPorts=8192,
+        uplinkPortPolicy=vim.DistributedVirtualSwitch
+        .NameArrayUplinkPortPolicy(uplinkPortName=list(uplink_names)),
+        uplinkPortgroup=[uplink_pg], host=members)
+
+
+_parser = argparse.ArgumentParser(
+    description='Run victl.py against fake vCenter with synthetic inventory',
+    epilog='Example: fake_vcenter.py -H 1000 check-portgroup -c Cluster1 '
+           '-g br100')
+_parser.add_argument('-V', '--vcenters', type=int, default=1,
+                     help='Number of vCenters, with more than one victl '
+                          'gets all of them in VICTL_VCENTERS')
+_parser.add_argument('-D', '--datacenters', type=int, default=1,
+                     help='Number of datacenters')
+_parser.add_argument('-c', '--clusters', type=int, default=1,
+                     help='Number of clusters in every datacenter')
+_parser.add_argument('-H', '--hosts', type=int, default=10,
+                     help='Number of hosts in every cluster')
+_parser.add_argument('-g', '--portgroups', type=int, default=4,
+                     help='Number of portgroups on every dvSwitch')
+_parser.add_argument('-s', '--datastores', type=int, default=2,
+                     help='Number of shared datastores in every datacenter')
+_parser.add_argument('-u', '--uplinks', type=int, default=2,
+                     help='Number of uplinks of every dvSwitch')
+_parser.add_argument('-p', '--ports', type=int, default=8,
+                     help='Number of ports in every portgroup')
+_parser.add_argument('argv', nargs=argparse.REMAINDER,
+                     help='victl.py command with its arguments')
+
+
+if __name__ == '__main__':
+    args = _parser.parse_args()
+
+    vcenters = []
+    for index in range(args.vcenters):
+        vcenters.append(generate(
+            args.datacenters, args.clusters, args.hosts, args.portgroups,
+            args.datastores, args.uplinks, args.ports,
+            FakeVCenter(host='fake-vcenter{0}'.format(index + 1)
+                        if index else 'fake-vcenter')))
+    install(*vcenters)
+    vcenter = vcenters[0]
+
+    if len(vcenters) > 1:
+        fd, computes = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as computes_file:
+            json.dump([{'vc_host': vc.host, 'vc_user': vc.user,
+                        'vc_password': vc.password} for vc in vcenters],
+                      computes_file)
+        atexit.register(os.remove, computes)
+        os.environ.setdefault('VICTL_VCENTERS', computes)
+
+    # connection arguments are not needed, fake vCenter takes defaults,
+    # the list of several vCenters replaces them
+    defaults = [('VC_DATACENTER', 'Datacenter')]
+    if len(vcenters) == 1:
+        defaults += [('VCENTER_IP', 'fake-vcenter'),
+                     ('VCENTER_USERNAME', vcenter.user),
+                     ('VCENTER_PASSWORD', vcenter.password)]
+    for env_var, value in defaults:
+        os.environ.setdefault(env_var, value)
+
+    sys.argv = [_victl] + args.argv
+    runpy.run_path(_victl, run_name='__main__')
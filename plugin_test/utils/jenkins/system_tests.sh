@@ -74,6 +74,7 @@ WORKSPACE  - path to directory where Fuelweb repository was checked out by Jenki
 JOB_NAME   - name of Jenkins job that determines which task should be done and ISO file name.
 
 If task name is "iso" it will make iso file
+If task name is "victl_bench" it will run benchmarks of victl.py on fake vCenter
 Other defined names will run Nose tests using previously built ISO file.
 
 ISO file name is taken from job name prefix
@@ -530,6 +531,21 @@ RunTest() {
     exit "${RES}"
 }
 
+RunVictlBench() {
+    # Check that victl starts fast and scales no worse than the committed
+    # baseline, fake vCenter is used so neither ISO nor environment is needed
+    BENCH="plugin_test/utils/jenkins/victl_bench.py"
+    if [ "${DRY_RUN}" = "yes" ]; then
+        echo python3 "${BENCH}" startup -o "${LOGS_DIR}/victl_startup.json"
+        echo python3 "${BENCH}" scale -s 10,100,1000 -r 5 -o "${LOGS_DIR}/victl_scale.json"
+        exit 0
+    fi
+
+    python3 "${BENCH}" startup -o "${LOGS_DIR}/victl_startup.json" || exit 1
+    python3 "${BENCH}" scale -s 10,100,1000 -r 5 -o "${LOGS_DIR}/victl_scale.json"
+    exit $?
+}
+
 RouteTasks() {
   # this selector defines task names that are recognised by this script
   # and runs corresponding jobs for them
@@ -542,6 +558,9 @@ RouteTasks() {
   iso)
     MakeISO
     ;;
+  victl_bench)
+    RunVictlBench
+    ;;
   *)
     echo "Unknown task: ${TASK_NAME}!"
     exit $INVALIDTASK_ERR
@@ -16,25 +16,87 @@ under the License.
 
 import argparse
 import atexit
+import copy
+import csv
+import fnmatch
+import hashlib
+import importlib
+import io
+import json
 import logging as log
-import ssl
+import math
+import os
+import random
+import re
+import shlex
+import signal
+import socket
+import socketserver
+import struct
 import sys
 import textwrap
+import threading
+import time
 
 from os import environ
 
-import paramiko
+# Messages of library and text output, the application configures them
+_log = log.getLogger('victl')
 
-from pyVim import connect
+# NDJSON records and data output like snapshots are written to stdout,
+# messages stay on stderr
+_records = log.getLogger('victl.records')
+_records.propagate = False
 
-from pyVmomi import vim
-from pyVmomi import vmodl
 
-import requests
+def _setup_logging():
+    """Configure output of victl run as a command."""
+    log.basicConfig(format='%(message)s', level=log.INFO)  # %(levelname)s:
+    _records.addHandler(log.StreamHandler(sys.stdout))
 
-requests.packages.urllib3.disable_warnings()
-log.getLogger("requests").setLevel(log.WARNING)
-log.basicConfig(format='%(message)s', level=log.INFO)  # %(levelname)s:
+
+class _LazyModule(object):
+    """Import module on the first access to its attributes.
+
+    pyVmomi, paramiko and requests take most of the startup time, while
+    help and argument errors do not need them at all.
+    """
+
+    def __init__(self, name, attr=None, setup=None):
+        """Save module name.
+
+        :param attr: attribute of module to use instead of module itself
+        :param setup: function which is called once with loaded module
+        """
+        self._name = name
+        self._attr = attr
+        self._setup = setup
+        self._module = None
+
+    def __getattr__(self, name):
+        """Return attribute of loaded module."""
+        if self.__dict__['_module'] is None:
+            module = importlib.import_module(self._name)
+            if self._setup:
+                self._setup(module)
+            self._module = getattr(module, self._attr) if self._attr \
+                else module
+        return getattr(self._module, name)
+
+
+def _setup_requests(module):
+    """Silence requests, certificates of vCenter are not verified."""
+    module.packages.urllib3.disable_warnings()
+    log.getLogger("requests").setLevel(log.WARNING)
+
+
+futures = _LazyModule('concurrent.futures')
+ssl = _LazyModule('ssl')
+paramiko = _LazyModule('paramiko')
+connect = _LazyModule('pyVim.connect')
+vim = _LazyModule('pyVmomi', 'vim')
+vmodl = _LazyModule('pyVmomi', 'vmodl')
+requests = _LazyModule('requests', setup=_setup_requests)
 
 
 class NotFoundException(Exception):
@@ -43,112 +105,1531 @@ class NotFoundException(Exception):
     pass
 
 
+# Managed object types which are read from vCenter in one pass and the
+# properties which are collected for each of them. The order matters: an
+# object is recorded under the first type it is an instance of.
+_inventory_spec = [
+    ('Datacenter', ['name', 'parent', 'hostFolder', 'networkFolder']),
+    ('ClusterComputeResource', ['name', 'parent', 'host']),
+    ('HostSystem', ['name', 'parent', 'network', 'datastore']),
+    ('DistributedVirtualSwitch', ['name', 'parent', 'portgroup',
+                                  'config.host', 'config.uplinkPortPolicy']),
+    ('DistributedVirtualPortgroup', ['name', 'parent']),
+    ('Network', ['name', 'parent']),
+    ('Datastore', ['name', 'parent', 'host']),
+    ('Folder', ['name', 'parent']),
+]
+
+
+def _dvs_members(members):
+    """Return plain list of dvSwitch members with their physical nics."""
+    result = []
+    for member in members or []:
+        backing = member.config.backing
+        pnics = getattr(backing, 'pnicSpec', None) or []
+        result.append({
+            'host': member.config.host._moId,
+            'pnics': [nic.pnicDevice for nic in pnics]
+        })
+    return result
+
+
+def _uplink_names(policy):
+    """Return names of dvSwitch uplink ports."""
+    return list(getattr(policy, 'uplinkPortName', None) or [])
+
+
+def _datastore_mounts(mounts):
+    """Return plain list of datastore mounts with their state."""
+    return [{
+        'host': mount.key._moId,
+        'mounted': bool(mount.mountInfo.mounted),
+        'accessible': bool(mount.mountInfo.accessible)
+    } for mount in mounts or []]
+
+
+# Version of inventory cache file layout
+_cache_format = 2
+
+# Properties which hold arrays, they are empty lists when unset
+_inventory_lists = {'host', 'network', 'datastore', 'portgroup',
+                    'config.host', 'config.uplinkPortPolicy'}
+
+# Converters for properties which hold data objects instead of references
+_inventory_converters = {
+    ('DistributedVirtualSwitch', 'config.host'): _dvs_members,
+    ('DistributedVirtualSwitch', 'config.uplinkPortPolicy'): _uplink_names,
+    ('Datastore', 'host'): _datastore_mounts,
+}
+
+
+# Objects and properties which watch follows, a subset of inventory
+_watch_spec = [
+    ('DistributedVirtualSwitch', ['name', 'portgroup', 'config.host',
+                                  'config.uplinkPortPolicy']),
+    ('HostSystem', ['name', 'network']),
+    ('Network', ['name']),
+]
+
+
+def _plain(value):
+    """Return managed object references as their ids."""
+    if hasattr(value, '_moId'):
+        return value._moId
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _uplink_order(port_config):
+    """Return active and standby uplinks of portgroup port config."""
+    teaming = getattr(port_config, 'uplinkTeamingPolicy', None)
+    order = getattr(teaming, 'uplinkPortOrder', None)
+    return {
+        'active': list(getattr(order, 'activeUplinkPort', None) or []),
+        'standby': list(getattr(order, 'standbyUplinkPort', None) or []),
+    }
+
+
+def _port_vlan(setting):
+    """Return VLAN id of port setting, ranges as text for trunk ports."""
+    vlan = getattr(setting, 'vlan', None)
+    if getattr(vlan, 'pvlanId', None) is not None:
+        return 'pvlan {0}'.format(vlan.pvlanId)
+    vlan_id = getattr(vlan, 'vlanId', None)
+    if isinstance(vlan_id, list):
+        return ','.join('{0}-{1}'.format(r.start, r.end) if r.start != r.end
+                        else str(r.start) for r in vlan_id)
+    return vlan_id
+
+
+def _dvport_record(port, inventory, portgroups):
+    """Return plain record of dvSwitch port.
+
+    :param portgroups: dictionary of portgroup keys and names
+    """
+    connectee = port.connectee
+    entity = _plain(getattr(connectee, 'connectedEntity', None))
+    if entity in inventory.objects:
+        entity = inventory.get(entity)['name']
+    runtime = getattr(port.state, 'runtimeInfo', None)
+    return {
+        'key': port.key,
+        'portgroup': portgroups.get(port.portgroupKey, port.portgroupKey),
+        'connectee': entity,
+        'connectee_type': getattr(connectee, 'type', None),
+        'nic': getattr(connectee, 'nicKey', None),
+        'vlan': _port_vlan(port.config.setting),
+        'link_up': getattr(runtime, 'linkUp', None),
+    }
+
+
+# Counters of perf command by default, network throughput and drops
+_perf_counters = ['net.bytesRx.average', 'net.bytesTx.average',
+                  'net.droppedRx.summation', 'net.droppedTx.summation']
+
+
+def _perf_counter_name(info):
+    """Return dotted name of performance counter like net.usage.average."""
+    return '{group}.{name}.{rollup}'.format(group=info.groupInfo.key,
+                                            name=info.nameInfo.key,
+                                            rollup=info.rollupType)
+
+
+def _perf_rows(metric, instances, names):
+    """Return samples of entity metric as rows per time and instance.
+
+    :param instances: dictionary of instances of entity with their labels
+    :param names: dictionary of counter ids and names
+    """
+    moid = metric.entity._moId
+    rows = {}
+    for series in metric.value or []:
+        instance = series.id.instance
+        if instance not in instances:
+            continue
+        for info, value in zip(metric.sampleInfo or [], series.value or []):
+            row = rows.get((info.timestamp, instance))
+            if row is None:
+                row = rows[(info.timestamp, instance)] = dict(
+                    instances[instance], time=info.timestamp.isoformat(),
+                    entity=moid, instance=instance)
+            row[names[series.id.counterId]] = value
+    return [row for _, row in sorted(rows.items())]
+
+
+def _inventory_type(obj):
+    """Return inventory type of managed object or None."""
+    for obj_type, _ in _inventory_spec:
+        if isinstance(obj, getattr(vim, obj_type)):
+            return obj_type
+    return None
+
+
+def _inventory_value(obj_type, name, value):
+    """Return plain value of collected property."""
+    if value is None:
+        return [] if name in _inventory_lists else None
+    return _inventory_converters.get((obj_type, name), _plain)(value)
+
+
+def _inventory_record(obj, props):
+    """Return inventory record for managed object and its properties."""
+    obj_type = _inventory_type(obj)
+    if obj_type is None:
+        return None
+
+    record = {'moid': obj._moId, 'type': obj_type}
+    for path in dict(_inventory_spec)[obj_type]:
+        record[path] = _inventory_value(obj_type, path, None)
+    for name, value in props:
+        record[name] = _inventory_value(obj_type, name, value)
+    return record
+
+
+class Inventory(object):
+    """In-memory copy of vCenter inventory properties.
+
+    Every object is stored as a dictionary with collected properties, its
+    'type' and 'moid'. References to other objects are stored as their ids.
+    Indexes by type, by parent and by name inside of datacenter are built
+    once, so lookups do not depend on the inventory size and on how deep
+    objects are nested in folders.
+    """
+
+    def __init__(self, objects=None):
+        """Store objects and build indexes."""
+        self.objects = objects or {}
+        self.reindex()
+
+    def reindex(self):
+        """Build type, parent, datacenter and name indexes."""
+        self._by_type = {}
+        self._children = {}
+        self._datacenter = {}
+        self._by_name = {}
+
+        for moid, obj in self.objects.items():
+            self._by_type.setdefault(obj['type'], []).append(moid)
+            self._children.setdefault(obj.get('parent'), []).append(moid)
+
+        for moid, obj in self.objects.items():
+            # datacenters are indexed at the top level
+            dc = None if obj['type'] == 'Datacenter' else \
+                self.datacenter_of(moid)
+            # the first object wins when names collide in nested folders
+            self._by_name.setdefault((dc, obj['type'], obj['name']), moid)
+
+    def apply_updates(self, update_set):
+        """Apply PropertyCollector update set and rebuild indexes."""
+        self._apply(update_set)
+        self.reindex()
+
+    def updated(self, update_set):
+        """Return copy of inventory with update set applied.
+
+        This inventory does not change, so it stays consistent for readers
+        in other threads. Records which are not changed are shared.
+        """
+        inventory = copy.copy(self)
+        inventory.objects = dict(self.objects)
+        inventory._apply(update_set)
+        inventory.reindex()
+        return inventory
+
+    def _apply(self, update_set):
+        """Apply update set to records, changed records are replaced."""
+        for filter_update in update_set.filterSet or []:
+            for update in filter_update.objectSet or []:
+                moid = update.obj._moId
+                changes = [(change.name,
+                            None if change.op in ('remove', 'indirectRemove')
+                            else change.val)
+                           for change in update.changeSet or []]
+
+                if update.kind == 'leave':
+                    self.objects.pop(moid, None)
+                elif update.kind == 'enter' or moid not in self.objects:
+                    record = _inventory_record(update.obj, changes)
+                    if record:
+                        self.objects[moid] = record
+                else:
+                    obj = dict(self.objects[moid])
+                    for name, value in changes:
+                        obj[name] = _inventory_value(obj['type'], name, value)
+                    self.objects[moid] = obj
+
+    def datacenter_of(self, moid):
+        """Return id of datacenter which object belongs to."""
+        chain = []
+        dc = None
+        while moid in self.objects:
+            if moid in self._datacenter:
+                dc = self._datacenter[moid]
+                break
+            if self.objects[moid]['type'] == 'Datacenter':
+                dc = moid
+                break
+            chain.append(moid)
+            moid = self.objects[moid].get('parent')
+
+        for item in chain:
+            self._datacenter[item] = dc
+        return dc
+
+    def get(self, moid):
+        """Return object with specified id."""
+        return self.objects[moid]
+
+    def get_many(self, moids):
+        """Return objects with specified ids skipping unknown ones."""
+        return [self.objects[moid] for moid in moids or []
+                if moid in self.objects]
+
+    def of_type(self, obj_type, datacenter=None):
+        """Return all objects of specified type.
+
+        :param datacenter: id of datacenter to look in, all if not set
+        """
+        return [self.objects[moid] for moid in self._by_type.get(obj_type, [])
+                if datacenter is None or
+                self.datacenter_of(moid) == datacenter]
+
+    def find(self, obj_type, name, datacenter=None):
+        """Return object of specified type and name or None.
+
+        :param datacenter: id of datacenter which object belongs to, it is
+                           None for datacenters themselves
+        """
+        moid = self._by_name.get((datacenter, obj_type, name))
+        return self.objects[moid] if moid else None
+
+    def children(self, parent, obj_type=None):
+        """Return direct children of specified object."""
+        return [self.objects[moid] for moid in self._children.get(parent, [])
+                if obj_type is None or self.objects[moid]['type'] == obj_type]
+
+    def names(self, moids):
+        """Return names of objects with specified ids."""
+        return [obj['name'] for obj in self.get_many(moids)]
+
+
+class SSHPool(object):
+    """Keep one SSH connection per host for repeated commands."""
+
+    connect_timeout = 3
+
+    def __init__(self):
+        """Create empty pool."""
+        self._clients = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, user, password):
+        """Return connected client for host, open it on first use."""
+        with self._lock:
+            host_lock = self._host_locks.setdefault(host, threading.Lock())
+
+        with host_lock:
+            client = self._clients.get(host)
+            if client:
+                transport = client.get_transport()
+                if transport and transport.is_active():
+                    return client
+                self.drop(host)
+
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(host, username=user, password=password,
+                           timeout=self.connect_timeout)
+            with self._lock:
+                self._clients[host] = client
+            return client
+
+    def drop(self, host):
+        """Close connection to host."""
+        with self._lock:
+            client = self._clients.pop(host, None)
+        if client:
+            client.close()
+
+    def close(self):
+        """Close all connections."""
+        for host in list(self._clients):
+            self.drop(host)
+
+
+def fan_out(func, items, workers):
+    """Call func for every item concurrently.
+
+    :param workers: maximum number of concurrent calls
+    :return: list of (item, result, exception) in order of items
+    """
+    with futures.ThreadPoolExecutor(max_workers=int(workers)) as pool:
+        jobs = [pool.submit(func, item) for item in items]
+
+    results = []
+    for item, job in zip(items, jobs):
+        try:
+            results.append((item, job.result(), None))
+        except Exception as e:
+            results.append((item, None, e))
+    return results
+
+
+class SoapStats(object):
+    """Statistics of SOAP calls made through pyVmomi stubs.
+
+    Calls are counted per vSphere method and per managed object type with
+    request and response sizes in bytes and a histogram of latencies.
+    """
+
+    # upper bounds of latency histogram buckets, in milliseconds
+    buckets = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+    def __init__(self):
+        """Create empty statistics."""
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.methods = {}
+        self.types = {}
+
+    def attach(self, stub):
+        """Record calls made through stub of a service instance."""
+        # session oriented stub wraps the one which does HTTP requests
+        stub = getattr(stub, 'soapStub', stub)
+        if getattr(stub, '_soap_stats', None) is self:
+            return
+        stub._soap_stats = self
+
+        invoke = stub.InvokeMethod
+        get_connection = stub.GetConnection
+
+        def invoke_method(mo, info, args, outerStub=None):
+            local = self._local
+            local.request = local.response = 0
+            start = time.time()
+            try:
+                return invoke(mo, info, args, outerStub)
+            finally:
+                self.record(info.wsdlName, mo._wsdlName,
+                            (time.time() - start) * 1000,
+                            local.request, local.response)
+
+        def count_request(request):
+            self._local.request = len(request)
+            return request
+
+        def get_connection_counted():
+            conn = get_connection()
+            if not hasattr(conn, '_soap_getresponse'):
+                conn._soap_getresponse = conn.getresponse
+                conn.getresponse = lambda: _CountedResponse(
+                    conn._soap_getresponse(), self._local)
+            return conn
+
+        stub.InvokeMethod = invoke_method
+        stub.GetConnection = get_connection_counted
+        stub.requestModifierList.append(count_request)
+
+    def record(self, method, mo_type, latency, request, response):
+        """Add a call to statistics, latency is in milliseconds."""
+        bucket = len(self.buckets)
+        for index, bound in enumerate(self.buckets):
+            if latency <= bound:
+                bucket = index
+                break
+
+        with self._lock:
+            for key, table in ((method, self.methods), (mo_type, self.types)):
+                stat = table.setdefault(key, {
+                    'calls': 0, 'request_bytes': 0, 'response_bytes': 0,
+                    'total_ms': 0.0, 'max_ms': 0.0,
+                    'histogram': [0] * (len(self.buckets) + 1)})
+                stat['calls'] += 1
+                stat['request_bytes'] += request
+                stat['response_bytes'] += response
+                stat['total_ms'] += latency
+                stat['max_ms'] = max(stat['max_ms'], latency)
+                stat['histogram'][bucket] += 1
+
+    def as_dict(self):
+        """Return statistics as JSON-serializable dictionary."""
+        with self._lock:
+            return {'buckets_ms': self.buckets,
+                    'methods': json.loads(json.dumps(self.methods)),
+                    'types': json.loads(json.dumps(self.types))}
+
+    def report(self, path):
+        """Write statistics as JSON to path, log a summary if it is '-'."""
+        stats = self.as_dict()
+        if path != '-':
+            with open(path, 'w') as output:
+                json.dump(stats, output, indent=2, sort_keys=True)
+            return
+
+        for title, table in (('method', stats['methods']),
+                             ('type', stats['types'])):
+            _log.info('{title:<40} {calls:>6} {sent:>10} {received:>10} '
+                      '{total:>9} {max:>8}'.format(
+                          title=title, calls='calls', sent='sent B',
+                          received='recv B', total='total ms', max='max ms'))
+            for key, stat in sorted(table.items(),
+                                    key=lambda item: -item[1]['total_ms']):
+                _log.info('{key:<40} {calls:>6} {request_bytes:>10} '
+                          '{response_bytes:>10} {total_ms:>9.1f} '
+                          '{max_ms:>8.1f}'.format(key=key, **stat))
+
+
+class _CountedResponse(object):
+    """HTTP response which counts bytes read from it."""
+
+    def __init__(self, response, counter):
+        """Wrap response, size is added to counter.response."""
+        self._response = response
+        self._counter = counter
+
+    def read(self, *args):
+        """Read from response and count the bytes."""
+        data = self._response.read(*args)
+        self._counter.response = getattr(self._counter, 'response', 0) + \
+            len(data)
+        return data
+
+    def __getattr__(self, name):
+        """Delegate everything else to the response."""
+        return getattr(self._response, name)
+
+
+# Version of session file layout
+_session_format = 1
+
+
+def _write_private_file(path, data):
+    """Write data as JSON to file readable by the owner only."""
+    file_dir = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(file_dir):
+        os.makedirs(file_dir, 0o700)
+
+    tmp_name = '{path}.{pid}'.format(path=path, pid=os.getpid())
+    fd = os.open(tmp_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as private_file:
+        json.dump(data, private_file)
+    os.rename(tmp_name, path)
+
+
+# Task properties which task tracker follows and their names in task state
+_task_props = {
+    'info.state': 'state',
+    'info.progress': 'progress',
+    'info.result': 'result',
+    'info.error': 'error',
+    'info.descriptionId': 'description',
+}
+_task_poll = 0.1  # seconds between polls of tasks in the last second
+
+
+class TaskTracker(object):
+    """Waits for many vSphere tasks through one PropertyCollector filter.
+
+    Tasks are put into a ListView which a private collector follows, so
+    state changes of all of them arrive as one stream of updates instead
+    of a polling loop per task. The collector and the view are destroyed
+    on exit from the with block.
+    """
+
+    def __init__(self, inst, progress=None):
+        """Create tracker on the session of Victl instance.
+
+        :param progress: function called with task moid and task state on
+                         every change, state is a dictionary with 'state',
+                         'progress', 'result', 'error' message,
+                         'description' and 'finished' time
+        """
+        self.inst = inst
+        self.progress = progress
+        self.tasks = {}  # task moid: task state
+        self._collector = None
+        self._view = None
+        self._version = ''
+
+    def __enter__(self):
+        content = self.inst.content
+        self._collector = content.propertyCollector.CreatePropertyCollector()
+        self._view = content.viewManager.CreateListView()
+        self._collector.CreateFilter(self.inst._inventory_filter_spec(
+            self._view, [('Task', sorted(_task_props))]),
+            partialUpdates=True)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._collector:
+            self._collector.DestroyPropertyCollector()
+            self._collector = None
+        if self._view:
+            self._view.Destroy()
+            self._view = None
+
+    def add(self, tasks):
+        """Start tracking tasks."""
+        new = [task for task in tasks if task._moId not in self.tasks]
+        for task in new:
+            self.tasks[task._moId] = dict.fromkeys(
+                list(_task_props.values()) + ['finished'])
+        if new:
+            self._view.ModifyListView(add=new)
+
+    def done(self, moid):
+        """Return True if task has finished."""
+        return self.tasks[moid]['finished'] is not None
+
+    def _apply(self, update_set):
+        """Apply task changes to their states."""
+        for filter_update in update_set.filterSet or []:
+            for update in filter_update.objectSet or []:
+                state = self.tasks.get(update.obj._moId)
+                if state is None:
+                    continue
+                for change in update.changeSet or []:
+                    if change.name not in _task_props:
+                        continue
+                    value = change.val if change.op == 'assign' else None
+                    if change.name == 'info.error' and value is not None:
+                        value = value.msg or type(value).__name__
+                    state[_task_props[change.name]] = value
+                if state['finished'] is None and state['state'] in (
+                        vim.TaskInfo.State.success, vim.TaskInfo.State.error):
+                    state['finished'] = time.time()
+                if self.progress:
+                    self.progress(update.obj._moId, dict(state))
+
+    def wait(self, tasks=None, timeout=None):
+        """Wait for tasks to finish.
+
+        :param tasks: tasks to wait for, all tracked tasks if not set
+        :param timeout: seconds to wait for all of them, may be fractional
+        :return: dictionary of task moids and their results
+        :raise Exception: if some tasks fail or do not finish in time
+        """
+        if tasks is not None:
+            self.add(tasks)
+        moids = [task._moId for task in tasks] if tasks is not None else \
+            list(self.tasks)
+        deadline = None if timeout is None else time.time() + timeout
+
+        pending = [moid for moid in moids if not self.done(moid)]
+        while pending:
+            options = vmodl.query.PropertyCollector.WaitOptions()
+            if deadline is not None:
+                # vCenter waits whole seconds, the rest is polled
+                options.maxWaitSeconds = max(int(deadline - time.time()), 0)
+            update_set = self._collector.WaitForUpdatesEx(self._version,
+                                                          options)
+            if update_set is not None:
+                self._apply(update_set)
+                self._version = update_set.version
+            pending = [moid for moid in pending if not self.done(moid)]
+
+            if pending and deadline is not None:
+                left = deadline - time.time()
+                if left <= 0:
+                    raise Exception('{pending} of {total} tasks did not '
+                                    'finish in {timeout} s'.format(
+                                        pending=len(pending),
+                                        total=len(moids), timeout=timeout))
+                if update_set is None and not options.maxWaitSeconds:
+                    time.sleep(min(left, _task_poll))
+
+        failed = [self.tasks[moid] for moid in moids
+                  if self.tasks[moid]['state'] == vim.TaskInfo.State.error]
+        if failed:
+            raise Exception('{failed} of {total} tasks failed: '
+                            '{errors}'.format(
+                                failed=len(failed), total=len(moids),
+                                errors='; '.join(
+                                    '{description}: {error}'.format(**state)
+                                    for state in failed)))
+        return {moid: self.tasks[moid]['result'] for moid in moids}
+
+
 class Victl(object):
     """VMware base actions."""
 
     _service_instance = None
+    _inventory = None
+    _inventory_collector = None
+    _inventory_version = None
+    _session_resumed = False
+    soap_stats = None
     content = None
 
-    def __init__(self, host, user, password, port):
-        """Create ssl context."""
+    def __init__(self, host, user, password, port, cache=None,
+                 soap_stats=None, session=None):
+        """Log in to vCenter.
+
+        Instance can be shared by threads, it is closed at exit if it is
+        not closed explicitly or used in a with block.
+
+        :param cache: path to the file where inventory is kept between runs
+        :param soap_stats: SoapStats to record SOAP calls of the session to
+        :param session: path to the file where vCenter session is kept
+                        between runs, it is not logged out at exit; with
+                        cache it is cache path with .session suffix by
+                        default, the collector of inventory lives in it
+        """
+        self.host = host
+        self.user = user
+        self.password = password
+        self.port = port
+        self.cache = cache
+        self.soap_stats = soap_stats
+        self.session = session or (cache and cache + '.session')
+        self.ssh = SSHPool()
+        # guards session and inventory, HTTP sessions are per thread
+        self._lock = threading.RLock()
+        self._http = threading.local()
+        self.connect()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Log out from vCenter and close ssh connections."""
+        self.disconnect()
+        self.ssh.close()
+        atexit.unregister(self.close)
+
+    def connect(self):
+        """Log in to vCenter, the previous session is dropped.
+
+        With session file the saved session is resumed if it is still
+        valid, a new session is saved there otherwise.
+        """
+        with self._lock:
+            try:
+                # workaround https://github.com/vmware/pyvmomi/issues/235
+                context = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
+                context.verify_mode = ssl.CERT_NONE
+                self._service_instance = None
+                if self.session:
+                    self._resume_session(context)
+                # objects of the session like collectors are still there
+                self._session_resumed = self._service_instance is not None
+
+                if not self._service_instance:
+                    self._service_instance = connect.SmartConnect(
+                        host=self.host, user=self.user, pwd=self.password,
+                        port=int(self.port), sslContext=context)
+
+                    if not self._service_instance:
+                        raise Exception('Could not connect to the specified '
+                                        'host using specified username and '
+                                        'password')
+
+                    if self.soap_stats:
+                        self.soap_stats.attach(self._service_instance._stub)
+                    if self.session:
+                        self._save_session()
+                    self.content = self._service_instance.RetrieveContent()
+
+                # collectors belong to the session
+                self._inventory_collector = None
+
+            except vmodl.MethodFault as e:
+                raise Exception('Caught vmodl fault: ' + e.msg)
+
+    def disconnect(self):
+        """Log out from vCenter, a saved session is left for next runs."""
+        with self._lock:
+            if self._service_instance:
+                if not self.session:
+                    connect.Disconnect(self._service_instance)
+                self._service_instance = None
+
+    def _resume_session(self, context):
+        """Use saved session if it is still valid.
+
+        Validation costs a single read of the current session, vCenter
+        returns nothing instead of a fault for an unknown cookie.
+        """
         try:
-            # workaround https://github.com/vmware/pyvmomi/issues/235
-            context = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
-            context.verify_mode = ssl.CERT_NONE
-            self._service_instance = connect.SmartConnect(host=host,
-                                                          user=user,
-                                                          pwd=password,
-                                                          port=int(port),
-                                                          sslContext=context)
-
-            if not self._service_instance:
-                raise Exception('Could not connect to the specified host using'
-                                ' specified username and password')
-
-            atexit.register(connect.Disconnect, self._service_instance)
-
-            self.content = self._service_instance.RetrieveContent()
+            with open(self.session) as session_file:
+                data = json.load(session_file)
+        except (IOError, ValueError):
+            return
+
+        if data.get('format') != _session_format or \
+                (data.get('host'), data.get('port'), data.get('user')) != \
+                (self.host, str(self.port), self.user):
+            return
+
+        stub = connect.SoapStubAdapter(host=self.host, port=int(self.port),
+                                       version=data['version'],
+                                       sslContext=context)
+        stub.cookie = data['cookie']
+        if self.soap_stats:
+            self.soap_stats.attach(stub)
+        service_instance = vim.ServiceInstance('ServiceInstance', stub)
+        try:
+            content = service_instance.RetrieveContent()
+            if content.sessionManager.currentSession:
+                self._service_instance = service_instance
+                self.content = content
+        except vmodl.MethodFault:
+            pass
+
+    def _save_session(self):
+        """Write cookie of the current session to session file."""
+        stub = self._service_instance._stub
+        _write_private_file(self.session, {
+            'format': _session_format,
+            'host': self.host,
+            'port': str(self.port),
+            'user': self.user,
+            'version': stub.version,
+            'cookie': stub.cookie,
+        })
+
+    @property
+    def inventory(self):
+        """Return inventory, it is retrieved from vCenter on first use."""
+        with self._lock:
+            if self._inventory is None:
+                if self.cache:
+                    self._load_inventory_cache()
+                    self.refresh_inventory()
+                else:
+                    self._inventory = self.retrieve_inventory()
+            return self._inventory
+
+    def _load_inventory_cache(self):
+        """Read inventory and PropertyCollector state from cache file.
+
+        The collector belongs to the session, so the cache is of no use
+        when the saved session was not resumed.
+        """
+        if not self._session_resumed:
+            return
+        try:
+            with open(self.cache) as cache_file:
+                data = json.load(cache_file)
+        except (IOError, ValueError):
+            return
+
+        if data.get('format') != _cache_format or \
+                (data.get('host'), data.get('user')) != (self.host, self.user):
+            return
+
+        self._inventory = Inventory(data['objects'])
+        self._inventory_version = data['version']
+        self._inventory_collector = vmodl.query.PropertyCollector(
+            data['collector'], self._service_instance._stub)
+
+    def _save_inventory_cache(self):
+        """Write inventory and PropertyCollector state to cache file."""
+        data = {
+            'format': _cache_format,
+            'host': self.host,
+            'user': self.user,
+            'collector': self._inventory_collector._moId,
+            'version': self._inventory_version,
+            'objects': self._inventory.objects,
+        }
+        _write_private_file(self.cache, data)
+
+    def _create_inventory_collector(self):
+        """Return private PropertyCollector with filter on inventory."""
+        collector = self.content.propertyCollector.CreatePropertyCollector()
+        view = self._create_inventory_view()
+        # the filter and the view live as long as the session does
+        collector.CreateFilter(self._inventory_filter_spec(view),
+                               partialUpdates=True)
+        return collector
+
+    def _wait_inventory_updates(self, inventory, version):
+        """Return inventory with all pending updates and new version."""
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0)
+        while True:
+            update_set = self._inventory_collector.WaitForUpdatesEx(version,
+                                                                    options)
+            if update_set is None:
+                return inventory, version
+
+            inventory = inventory.updated(update_set)
+            version = update_set.version
+            if not update_set.truncated:
+                return inventory, version
+
+    def refresh_inventory(self):
+        """Bring inventory up to date.
+
+        Only changes since the last known PropertyCollector version are
+        fetched when the collector is still alive, otherwise the inventory
+        is reloaded completely. Changes come as a new Inventory, the one
+        returned before stays consistent for threads which use it.
+        """
+        with self._lock:
+            if self._inventory is not None and self._inventory_collector:
+                try:
+                    self._inventory, self._inventory_version = \
+                        self._wait_inventory_updates(self._inventory,
+                                                     self._inventory_version)
+                except vmodl.MethodFault:
+                    self._inventory = None
+
+            if self._inventory is None or not self._inventory_collector:
+                self._inventory_collector = \
+                    self._create_inventory_collector()
+                self._inventory, self._inventory_version = \
+                    self._wait_inventory_updates(Inventory(), '')
+
+            if self.cache:
+                self._save_inventory_cache()
+
+            return self._inventory
+
+    def _inventory_filter_spec(self, view, spec=None):
+        """Return filter spec which collects inventory through view.
+
+        :param spec: list of (type, properties), whole inventory if not set
+        """
+        collector = vmodl.query.PropertyCollector
+        traversal = collector.TraversalSpec(name='traverseEntities',
+                                            path='view', skip=False,
+                                            type=type(view))
+        obj_spec = collector.ObjectSpec(obj=view, skip=True,
+                                        selectSet=[traversal])
+        prop_specs = [collector.PropertySpec(type=getattr(vim, obj_type),
+                                             pathSet=props)
+                      for obj_type, props in spec or _inventory_spec]
+        return collector.FilterSpec(objectSet=[obj_spec],
+                                    propSet=prop_specs)
+
+    def _create_inventory_view(self, container=None, spec=None):
+        """Return container view with all inventory objects.
+
+        :param container: folder or datacenter, root folder if not set
+        :param spec: list of (type, properties), whole inventory if not set
+        """
+        types = [getattr(vim, obj_type)
+                 for obj_type, _ in spec or _inventory_spec]
+        return self.content.viewManager.CreateContainerView(
+            container or self.content.rootFolder, types, True)
+
+    def _retrieve_contents(self, filter_spec):
+        """Yield (object, [(property, value)]) page by page."""
+        collector = self.content.propertyCollector
+        result = collector.RetrievePropertiesEx(
+            [filter_spec], vmodl.query.PropertyCollector.RetrieveOptions())
+        while result:
+            for content in result.objects:
+                yield content.obj, [(p.name, p.val)
+                                    for p in content.propSet or []]
+            if not result.token:
+                break
+            result = collector.ContinueRetrievePropertiesEx(result.token)
+
+    def retrieve_inventory(self):
+        """Return inventory collected in one RetrievePropertiesEx pass."""
+        view = self._create_inventory_view()
+        try:
+            objects = {}
+            for obj, props in self._retrieve_contents(
+                    self._inventory_filter_spec(view)):
+                record = _inventory_record(obj, props)
+                if record:
+                    objects[record['moid']] = record
+        finally:
+            view.Destroy()
 
-        except vmodl.MethodFault as e:
-            raise Exception('Caught vmodl fault: ' + e.msg)
+        return Inventory(objects)
 
     def get_dc_object(self, datacenter):
         """Return datacenter object with specified name."""
-        for dc in self.content.rootFolder.childEntity:
-            if dc.name == datacenter:
-                return dc
+        dc = self.inventory.find('Datacenter', datacenter)
+        if dc:
+            return dc
 
         raise NotFoundException("Can not find dc "
                                 "'{dc_name}'".format(dc_name=datacenter))
 
+    def _get_cluster_object(self, dc, cluster):
+        """Return cluster object with specified name."""
+        _cluster = self.inventory.find('ClusterComputeResource', cluster,
+                                       dc['moid'])
+        if _cluster:
+            return _cluster
+
+        raise NotFoundException("Cluster '{cl_name}' is empty".format(
+            cl_name=cluster))
+
     def get_cluster_hosts(self, dc, cluster):
         """Return list of hosts names in specified cluster."""
-        host_folder = dc.hostFolder
-        for _cluster in host_folder.childEntity:
-            if _cluster.name == cluster:
-                return [host.name for host in _cluster.host]
-
-        raise Exception("Cluster '{cl_name}' is empty".format(cl_name=cluster))
+        return self.inventory.names(
+            self._get_cluster_object(dc, cluster)['host'])
 
     def get_cluster_hosts_objects(self, dc, cluster):
-        """Return list of hosts names in specified cluster."""
-        host_folder = dc.hostFolder
-        for _cluster in host_folder.childEntity:
-            if _cluster.name == cluster:
-                return _cluster.host
+        """Return list of hosts objects in specified cluster."""
+        return self.inventory.get_many(
+            self._get_cluster_object(dc, cluster)['host'])
+
+    def get_host_object(self, dc, host):
+        """Return esxi host object with specified name."""
+        esxi = self.inventory.find('HostSystem', host, dc['moid'])
+        if esxi:
+            return esxi
+
+        raise NotFoundException("Esxi '{host}' not found".format(host=host))
+
+    def get_datastore_object(self, dc, datastore):
+        """Return datastore object with specified name."""
+        ds = self.inventory.find('Datastore', datastore, dc['moid'])
+        if ds:
+            return ds
+
+        raise NotFoundException("Datastore '{ds}' not found on '{dc}' "
+                                "datacenter".format(ds=datastore,
+                                                    dc=dc['name']))
 
     def get_vds_object(self, dc, vds):
         """Return dvSwitch object with specified name."""
-        network_folder = dc.networkFolder
-        for net in network_folder.childEntity:
-            if isinstance(net, vim.DistributedVirtualSwitch):
-                if net.name == vds:
-                    return net
+        net = self.inventory.find('DistributedVirtualSwitch', vds, dc['moid'])
+        if net:
+            return net
 
         raise NotFoundException("dvSwitch '{vds}' not found".format(vds=vds))
 
     def get_vds_hosts(self, datacenter, vdswitch):
         """Return list of hosts names in specified dvSwitch."""
         dc = self.get_dc_object(datacenter)
-        vds = inst.get_vds_object(dc, vdswitch)
-        return [host.config.host.name for host in vds.config.host]
+        vds = self.get_vds_object(dc, vdswitch)
+        return self.inventory.names(
+            [member['host'] for member in vds['config.host']])
 
     def get_nics_for_hosts_in_vds(self, hosts, vds):
-        """Return list of nics for specified hosts in dvSwitch."""
-        nics = []
-        for host in vds.config.host:
-            if host.config.host.name in hosts:
-                nics.append([nic.pnicDevice for nic
-                             in host.config.backing.pnicSpec])
+        """Return nics attached to dvSwitch for specified hosts names."""
+        hosts = set(hosts)
+        nics = {}
+        for member in vds['config.host']:
+            host = self.inventory.objects.get(member['host'])
+            if host and host['name'] in hosts:
+                nics[host['name']] = member['pnics']
 
         return nics
 
+    def dvs_host_states(self, datacenter, cluster, vdswitch, vmnic):
+        """Return attachment of every host in cluster to dvSwitch.
+
+        :param vmnic: nic which must be attached to dvSwitch
+        :return: list of dictionaries with 'host', 'vds' names, 'member'
+                 flag of dvSwitch membership, 'nics' attached to dvSwitch,
+                 'attached' flag of vmnic and 'extra_nics', host by host
+        """
+        dc = self.get_dc_object(datacenter)
+        vds = self.get_vds_object(dc, vdswitch)
+        hosts = self.get_cluster_hosts(dc, cluster)
+        nics = self.get_nics_for_hosts_in_vds(hosts, vds)
+
+        states = []
+        for host in hosts:
+            host_nics = nics.get(host, [])
+            states.append({
+                'host': host,
+                'vds': vds['name'],
+                'member': host in nics,
+                'nics': host_nics,
+                'attached': vmnic in host_nics,
+                'extra_nics': sorted(set(host_nics) - {vmnic}),
+            })
+        return states
+
+    def dvs_snapshot(self, datacenter):
+        """Return topology of dvSwitches in datacenter as plain data.
+
+        Every dvSwitch has its uplinks, portgroups and hosts with the
+        physical nics they attach to it.
+        """
+        dc = self.get_dc_object(datacenter)
+        dvswitches = {
+            vds['name']: _dvs_topology(self.inventory, vds)
+            for vds in self.inventory.of_type('DistributedVirtualSwitch',
+                                              dc['moid'])}
+
+        return {
+            'format': _snapshot_format,
+            'vcenter': self.host,
+            'datacenter': datacenter,
+            'time': int(time.time()),
+            'dvswitches': dvswitches,
+        }
+
+    def watch_dvs(self, datacenter, wait=30, duration=None):
+        """Yield lists of changes of dvSwitches and hosts as they happen.
+
+        A private PropertyCollector filter follows dvSwitches, portgroups
+        and host networks of datacenter, vCenter is not polled. Changes have
+        the form diff_dvs_snapshots returns, with esxi_added, esxi_removed
+        and networks_changed for hosts.
+
+        :param wait: seconds to block in one WaitForUpdatesEx call, an
+                     empty list is yielded when nothing changed
+        :param duration: seconds to watch for, forever if not set
+        """
+        if wait < 1:
+            raise Exception('Seconds to wait for changes must be at least 1')
+
+        dc = self.get_dc_object(datacenter)
+        deadline = duration and time.time() + duration
+        collector = self.content.propertyCollector.CreatePropertyCollector()
+        view = self._create_inventory_view(
+            vim.Datacenter(dc['moid'], self._service_instance._stub),
+            _watch_spec)
+        try:
+            collector.CreateFilter(
+                self._inventory_filter_spec(view, _watch_spec),
+                partialUpdates=True)
+            state = Inventory()
+            started = False
+            # state before truncated update sets and objects changed in them
+            before = None
+            moids = set()
+            version = ''
+            while True:
+                options = vmodl.query.PropertyCollector.WaitOptions(
+                    maxWaitSeconds=wait)
+                if deadline:
+                    left = deadline - time.time()
+                    if left <= 0:
+                        return
+                    options.maxWaitSeconds = min(wait, int(math.ceil(left)))
+                update_set = collector.WaitForUpdatesEx(version, options)
+                if update_set is None:
+                    yield []
+                    continue
+
+                if before is None:
+                    before = state
+                moids |= {update.obj._moId
+                          for filter_update in update_set.filterSet or []
+                          for update in filter_update.objectSet or []}
+                state = state.updated(update_set)
+                version = update_set.version
+                if update_set.truncated:
+                    continue
+
+                # the first complete update brings the current state
+                if started:
+                    yield _watch_changes(_watch_view(before, moids),
+                                         _watch_view(state, moids))
+                started = True
+                before = None
+                moids = set()
+        finally:
+            collector.DestroyPropertyCollector()
+            view.Destroy()
+
+    def portgroup_teaming(self, datacenter):
+        """Return uplink order of every dvSwitch portgroup in datacenter.
+
+        Policies are collected in one RetrievePropertiesEx pass, uplink
+        portgroups of dvSwitches are skipped.
+
+        :return: list of dictionaries with 'portgroup', 'dvswitch' names
+                 and 'active', 'standby' uplinks in their order
+        """
+        dc = self.get_dc_object(datacenter)
+        spec = [('DistributedVirtualSwitch',
+                 ['name', 'config.uplinkPortgroup']),
+                ('DistributedVirtualPortgroup',
+                 ['name', 'config.distributedVirtualSwitch',
+                  'config.defaultPortConfig'])]
+        view = self._create_inventory_view(
+            vim.Datacenter(dc['moid'], self._service_instance._stub), spec)
+        try:
+            dvswitches = {}
+            portgroups = []
+            for obj, props in self._retrieve_contents(
+                    self._inventory_filter_spec(view, spec)):
+                props = dict(props)
+                if isinstance(obj, vim.DistributedVirtualSwitch):
+                    dvswitches[obj._moId] = (
+                        props.get('name'),
+                        set(_plain(props.get('config.uplinkPortgroup') or [])))
+                else:
+                    portgroups.append((obj._moId, props))
+        finally:
+            view.Destroy()
+
+        teaming = []
+        for moid, props in portgroups:
+            vds = props.get('config.distributedVirtualSwitch')
+            name, uplink_portgroups = dvswitches.get(_plain(vds), (None, ()))
+            if name is None or moid in uplink_portgroups:
+                continue
+            state = {'portgroup': props.get('name'), 'dvswitch': name}
+            state.update(_uplink_order(props.get('config.defaultPortConfig')))
+            teaming.append(state)
+        return sorted(teaming, key=lambda state: (state['dvswitch'],
+                                                  state['portgroup']))
+
+    def teaming_states(self, datacenter, net_maps):
+        """Return uplink order of portgroups compared with net maps.
+
+        Every portgroup of a mapped dvSwitch must have the mapped active and
+        standby uplinks in the same order, dvSwitches mapped without uplinks
+        are not checked.
+
+        :param net_maps: list of (cluster, vds, active, standby) mappings
+        :return: list of portgroup_teaming states of mapped dvSwitches with
+                 'expected_active', 'expected_standby' uplinks and 'ok' flag
+        :raise Exception: if dvSwitch is mapped with different uplinks
+        """
+        expected = {}
+        for cluster, vds, active, standby in net_maps:
+            if not active and not standby:
+                continue
+            if expected.setdefault(vds, (active, standby)) != \
+                    (active, standby):
+                raise Exception("dvSwitch '{vds}' is mapped with different "
+                                "uplinks for several clusters".format(
+                                    vds=vds))
+
+        states = []
+        for state in self.portgroup_teaming(datacenter):
+            if state['dvswitch'] not in expected:
+                continue
+            active, standby = expected[state['dvswitch']]
+            state.update(expected_active=active, expected_standby=standby,
+                         ok=(state['active'], state['standby']) ==
+                         (active, standby))
+            states.append(state)
+        return states
+
+    def dvports(self, datacenter, vdswitch, portgroups=None, connected=None,
+                active=None, page_size=500):
+        """Yield ports of dvSwitch which match criteria.
+
+        Keys of matching ports are fetched at once and ports themselves by
+        page_size keys, so only one page of ports is held in memory.
+
+        :param portgroups: names or shell-style patterns of portgroups,
+                           ports of all portgroups if not set
+        :param connected: True or False for ports with or without connectee
+        :param active: True or False for ports which are in use or not
+        :return: generator of dictionaries with port 'key', 'portgroup',
+                 'connectee' name or moid, 'connectee_type', 'nic', 'vlan'
+                 and 'link_up'
+        """
+        dc = self.get_dc_object(datacenter)
+        vds = self.get_vds_object(dc, vdswitch)
+        names = {pg['moid']: pg['name']
+                 for pg in self.inventory.get_many(vds['portgroup'])}
+
+        criteria = vim.dvs.PortCriteria(connected=connected, active=active)
+        if portgroups:
+            keys = []
+            for pattern in portgroups:
+                matched = [moid for moid, name in sorted(names.items())
+                           if fnmatch.fnmatchcase(name, pattern)]
+                if not matched:
+                    raise NotFoundException(
+                        "Portgroup '{pg}' not found on dvSwitch "
+                        "'{vds}'".format(pg=pattern, vds=vdswitch))
+                keys.extend(moid for moid in matched if moid not in keys)
+            criteria.inside = True
+            criteria.portgroupKey = keys
+
+        for port in self._fetch_dvports(vds, criteria, page_size):
+            yield _dvport_record(port, self.inventory, names)
+
+    def _fetch_dvports(self, vds, criteria, page_size):
+        """Yield ports of dvSwitch which match criteria page by page."""
+        ref = vim.DistributedVirtualSwitch(vds['moid'],
+                                           self._service_instance._stub)
+        port_keys = ref.FetchDVPortKeys(criteria) or []
+        for start in range(0, len(port_keys), page_size):
+            page = ref.FetchDVPorts(vim.dvs.PortCriteria(
+                portKey=port_keys[start:start + page_size]))
+            for port in page or []:
+                yield port
+
+    def perf_counters(self, names):
+        """Return performance counters with dotted names.
+
+        :param names: names like net.bytesRx.average
+        :return: dictionary of names and PerfCounterInfo in order of names
+        :raise NotFoundException: if vCenter has no such counter
+        """
+        counters = {_perf_counter_name(info): info
+                    for info in self.content.perfManager.perfCounter}
+        for name in names:
+            if name not in counters:
+                raise NotFoundException(
+                    "Performance counter '{name}' not found".format(
+                        name=name))
+        return {name: counters[name] for name in names}
+
+    def perf_entities(self, datacenter, cluster, page_size=500):
+        """Return network instances of cluster for performance queries.
+
+        Physical nics of cluster hosts in dvSwitches come from inventory.
+        Ports connected to virtual machines on these hosts are fetched per
+        dvSwitch, their counters belong to the virtual machine nic.
+
+        :return: dictionary of entity moids with their 'type' and
+                 'instances', every instance has 'kind' vmnic or dvport,
+                 'host', 'dvswitch' names and 'port' key
+        """
+        dc = self.get_dc_object(datacenter)
+        hosts = {host['moid']: host['name']
+                 for host in self.get_cluster_hosts_objects(dc, cluster)}
+        stub = self._service_instance._stub
+
+        entities = {}
+
+        def add(moid, obj_type, instance, **labels):
+            entity = entities.setdefault(moid, {'type': obj_type,
+                                                'instances': {}})
+            entity['instances'][instance] = labels
+
+        for vds in self.inventory.of_type('DistributedVirtualSwitch',
+                                          dc['moid']):
+            members = [member for member in vds['config.host']
+                       if member['host'] in hosts]
+            if not members:
+                continue
+            for member in members:
+                for pnic in member['pnics']:
+                    add(member['host'], 'HostSystem', pnic, kind='vmnic',
+                        host=hosts[member['host']], dvswitch=vds['name'],
+                        port=None)
+
+            criteria = vim.dvs.PortCriteria(
+                connected=True, uplinkPort=False,
+                host=[vim.HostSystem(member['host'], stub)
+                      for member in members])
+            for port in self._fetch_dvports(vds, criteria, page_size):
+                if port.connectee.type != 'vmVnic':
+                    continue
+                add(port.connectee.connectedEntity._moId, 'VirtualMachine',
+                    port.connectee.nicKey, kind='dvport',
+                    host=hosts.get(_plain(port.proxyHost)),
+                    dvswitch=vds['name'], port=port.key)
+        return entities
+
+    def perf_samples(self, datacenter, cluster, counters, query_size=64,
+                     duration=None, page_size=500):
+        """Yield lists of realtime samples of vmnics and dvSwitch ports.
+
+        Entities are resolved once. Every realtime interval their specs go
+        to QueryPerf by query_size, the first query takes the latest sample
+        and the next ones only samples which are newer than seen.
+
+        :param counters: dictionary which perf_counters returns
+        :param duration: seconds to collect samples for, forever if not set
+        :return: generator of lists of dictionaries with 'time', 'kind',
+                 'host', 'dvswitch', 'port', 'entity', 'instance' and value
+                 of every counter by its name
+        """
+        entities = self.perf_entities(datacenter, cluster, page_size)
+        if not entities:
+            return
+
+        perf = self.content.perfManager
+        stub = self._service_instance._stub
+        names = {info.key: name for name, info in counters.items()}
+        refs = {moid: getattr(vim, entity['type'])(moid, stub)
+                for moid, entity in entities.items()}
+        interval = perf.QueryPerfProviderSummary(
+            next(iter(refs.values()))).refreshRate
+        metric_id = vim.PerformanceManager.MetricId
+        specs = {}
+        for moid, entity in entities.items():
+            specs[moid] = vim.PerformanceManager.QuerySpec(
+                entity=refs[moid], intervalId=interval, maxSample=1,
+                metricId=[metric_id(counterId=info.key, instance=instance)
+                          for instance in sorted(entity['instances'])
+                          for info in counters.values()])
+        order = sorted(specs)
+        batches = [[specs[moid] for moid in order[start:start + query_size]]
+                   for start in range(0, len(order), query_size)]
+
+        deadline = duration and time.time() + duration
+        while True:
+            samples = []
+            for batch in batches:
+                for metric in perf.QueryPerf(batch) or []:
+                    moid = metric.entity._moId
+                    samples.extend(_perf_rows(
+                        metric, entities[moid]['instances'], names))
+                    if metric.sampleInfo:
+                        specs[moid].startTime = \
+                            metric.sampleInfo[-1].timestamp
+                        specs[moid].maxSample = None
+            yield sorted(samples, key=lambda sample: sample['time'])
+
+            if deadline and time.time() + interval > deadline:
+                return
+            time.sleep(interval)
+
+    def task_tracker(self, progress=None):
+        """Return tracker of tasks, use it in a with block.
+
+        :param progress: function called on every change of task state
+        """
+        return TaskTracker(self, progress)
+
+    def wait_task(self, task, timeout=None):
+        """Wait for vSphere task to finish, return its result.
+
+        :raise Exception: if task fails or does not finish in timeout seconds
+        """
+        with self.task_tracker() as tracker:
+            return tracker.wait([task], timeout)[task._moId]
+
+    def _find_portgroups(self, dc, vds, names):
+        """Return references of dvSwitch portgroups with names."""
+        spec = [('DistributedVirtualPortgroup',
+                 ['name', 'config.distributedVirtualSwitch'])]
+        view = self._create_inventory_view(
+            vim.Datacenter(dc['moid'], self._service_instance._stub), spec)
+        try:
+            found = []
+            for obj, props in self._retrieve_contents(
+                    self._inventory_filter_spec(view, spec)):
+                props = dict(props)
+                if props.get('name') in names and _plain(props.get(
+                        'config.distributedVirtualSwitch')) == vds['moid']:
+                    found.append(obj)
+            return found
+        finally:
+            view.Destroy()
+
+    def churn_portgroups(self, datacenter, vdswitch, count, batch_size,
+                         prefix='victl-churn', timeout=None):
+        """Create count portgroups on dvSwitch and destroy them.
+
+        Portgroups named <prefix>-<n> are created by one multi-spec
+        AddDVPortgroup_Task per batch_size names and destroyed by
+        batch_size Destroy_Task calls started together, a batch starts
+        when the previous one is done. Portgroups created by the run are
+        destroyed even if creation fails.
+
+        :return: dictionary with 'create' and 'destroy' lists of batch
+                 latencies and 'create_s', 'destroy_s' durations of phases,
+                 all in seconds
+        :raise Exception: if dvSwitch already has portgroups with these
+                          names, nothing is created then
+        """
+        if count < 1 or batch_size < 1:
+            raise Exception('Number of portgroups and batch size must be at '
+                            'least 1')
+
+        dc = self.get_dc_object(datacenter)
+        vds = self.get_vds_object(dc, vdswitch)
+        ref = vim.DistributedVirtualSwitch(vds['moid'],
+                                           self._service_instance._stub)
+        names = ['{prefix}-{n}'.format(prefix=prefix, n=n)
+                 for n in range(count)]
+        # AddDVPortgroup_Task gives no references of created portgroups,
+        # they are found by name, so the names must not be taken before
+        existing = self._find_portgroups(dc, vds, set(names))
+        if existing:
+            raise Exception("dvSwitch '{vds}' already has {count} "
+                            "portgroup(s) named '{prefix}-<n>', choose "
+                            "another prefix".format(vds=vdswitch,
+                                                    count=len(existing),
+                                                    prefix=prefix))
+
+        result = {'create': [], 'destroy': []}
+        with self.task_tracker() as tracker:
+            start = time.time()
+            try:
+                for first in range(0, count, batch_size):
+                    specs = [vim.dvs.DistributedVirtualPortgroup.ConfigSpec(
+                        name=name, type='earlyBinding', numPorts=0)
+                        for name in names[first:first + batch_size]]
+                    batch_start = time.time()
+                    tracker.wait([ref.AddDVPortgroup_Task(specs)], timeout)
+                    result['create'].append(time.time() - batch_start)
+            finally:
+                result['create_s'] = time.time() - start
+                start = time.time()
+                created = self._find_portgroups(dc, vds, set(names))
+                for first in range(0, len(created), batch_size):
+                    batch_start = time.time()
+                    tracker.wait([pg.Destroy_Task()
+                                  for pg in created[first:first + batch_size]],
+                                 timeout)
+                    result['destroy'].append(time.time() - batch_start)
+                result['destroy_s'] = time.time() - start
+        return result
+
     def get_clusters(self, datacenter):
         """Return list of clusters names in specified datacenter."""
         dc = self.get_dc_object(datacenter)
-        host_folder = dc.hostFolder
-        return [cluster.name for cluster in host_folder.childEntity]
+        return [cluster['name'] for cluster in self.inventory.of_type(
+            'ClusterComputeResource', dc['moid'])]
+
+    def check_net_map(self, datacenter, cluster, vdswitch, active=(),
+                      standby=()):
+        """Return list of problems with cluster to dvSwitch mapping.
 
-    def _exec_command(self, host, user, password, cmd):
-        """Execute command remotely and return output."""
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        :param active: names of active uplinks expected on dvSwitch
+        :param standby: names of standby uplinks expected on dvSwitch
+        """
+        dc = self.get_dc_object(datacenter)
+        try:
+            hosts = self.get_cluster_hosts(dc, cluster)
+            vds = self.get_vds_object(dc, vdswitch)
+        except NotFoundException as e:
+            return [str(e)]
+
+        err = []
+        uplinks = list(active) + list(standby)
+        for uplink in uplinks:
+            if uplink not in vds['config.uplinkPortPolicy']:
+                err.append("Uplink '{uplink}' not found on dvSwitch "
+                           "'{vds}'".format(uplink=uplink, vds=vdswitch))
+
+        nics = self.get_nics_for_hosts_in_vds(hosts, vds)
+        for host in hosts:
+            if host not in nics:
+                err.append("Host '{host}' not found on dvSwitch "
+                           "'{vds}'".format(host=host, vds=vdswitch))
+            elif len(nics[host]) < max(len(uplinks), 1):
+                err.append("Host '{host}' has {nics} nic(s) attached to "
+                           "dvSwitch '{vds}' for {uplinks} uplink(s)".format(
+                               host=host, nics=len(nics[host]),
+                               vds=vdswitch, uplinks=len(uplinks)))
+        return err
+
+    def _exec_command(self, host, user, password, cmd, timeout=None):
+        """Execute command remotely and return output.
+
+        :param timeout: seconds to wait for command output
+        """
         try:
-            client.connect(host, username=user, password=password, timeout=3)
-            stdin, stdout, stderr = client.exec_command(cmd)
+            client = self.ssh.get(host, user, password)
+            stdin, stdout, stderr = client.exec_command(cmd, timeout=timeout)
             out = stdout.read()
         except TypeError:
             raise Exception('There are no valid connections')
-        finally:
-            if client:
-                client.close()
+        except (paramiko.SSHException, socket.error):
+            self.ssh.drop(host)
+            raise
         return out
 
-    def check_netcpad(self, host, user, password, print_error=False):
+    def check_netcpad(self, host, user, password, print_error=False,
+                      timeout=None):
         """Check up whether connection with nsxv controller is established."""
         cmd = r"esxcli network ip connection list | grep tcp | grep 1234 | " \
               r"grep ESTABLISHED"
-        out = self._exec_command(host, user, password, cmd)
+        out = self._exec_command(host, user, password, cmd, timeout)
         if not out:
             if print_error:
                 raise Exception("Host '{host}' not connected to nsxv "
@@ -156,83 +1637,178 @@ class Victl(object):
             return False
         return True
 
-    def restart_netcpad(self, host, user, password):
+    def restart_netcpad(self, host, user, password, timeout=None):
         """Restart netcpad."""
-        log.info("Host '{host}', try restart netcpad".format(host=host))
+        _log.info("Host '{host}', try restart netcpad".format(host=host))
 
         cmd = r"/etc/init.d/netcpad restart"
-        self._exec_command(host, user, password, cmd)
+        self._exec_command(host, user, password, cmd, timeout)
 
-    def check_portgroup_configured(self, datacenter, cluster, portgroup):
-        """Check up whether portgroup is configured."""
-        err = ''
+    def ensure_netcpad(self, host, user, password, timeout=None):
+        """Restart netcpad if needed, raise if host is not connected.
+
+        :return: True if netcpad was restarted
+        """
+        if self.check_netcpad(host, user, password, timeout=timeout):
+            return False
+
+        self.restart_netcpad(host, user, password, timeout)
+        self.check_netcpad(host, user, password, True, timeout)
+        return True
+
+    def esxi_states(self, datacenter, cluster, user, password, timeout=None,
+                    workers=8):
+        """Return connection of every host in cluster to nsxv controller.
+
+        Hosts are checked concurrently, netcpad is restarted on hosts which
+        are not connected, every host reuses one ssh connection.
+
+        :param user: ssh user of esxi hosts
+        :param password: ssh password of esxi hosts
+        :param workers: maximum number of hosts checked at once
+        :return: list of dictionaries with 'host' name, 'restarted' and
+                 'connected' flags and 'error' message, host by host
+        """
+        dc = self.get_dc_object(datacenter)
+        hosts = self.get_cluster_hosts(dc, cluster)
+        results = fan_out(
+            lambda host: self.ensure_netcpad(host, user, password, timeout),
+            hosts, workers)
+
+        return [{'host': host, 'restarted': restarted,
+                 'connected': error is None,
+                 'error': None if error is None else str(error)}
+                for host, restarted, error in results]
+
+    def portgroup_matrix(self, datacenter, cluster, portgroups):
+        """Return presence of portgroups on every host in cluster.
+
+        Names of host networks are collected once per host, so dozens of
+        portgroups are checked in one pass over the inventory.
+
+        :param portgroups: names or shell-style patterns of portgroups,
+                           patterns are expanded to names of networks of
+                           cluster hosts, pattern which matches nothing is
+                           kept as is and reported as missing
+        :return: tuple of (portgroup names, {host name: missing names})
+        """
         dc = self.get_dc_object(datacenter)
         hosts = self.get_cluster_hosts_objects(dc, cluster)
-        for esxi in hosts:
-            if portgroup not in [pg.name for pg in esxi.network]:
-                err += "On esxi '{esxi}' portgroup '{portgr}' "\
-                       "not found".format(esxi=esxi.name,
-                                          portgr=portgroup)
+
+        present = dict((esxi['name'], set(self.inventory.names(
+            esxi['network']))) for esxi in hosts)
+        networks = set().union(*present.values())
+
+        names = []
+        for portgroup in portgroups:
+            matched = [portgroup]
+            if any(char in portgroup for char in '*?['):
+                matched = sorted(fnmatch.filter(networks, portgroup)) or \
+                    matched
+            names.extend(name for name in matched if name not in names)
+
+        missing = {}
+        for esxi, networks in present.items():
+            missing[esxi] = [name for name in names if name not in networks]
+        return names, missing
+
+    def portgroup_states(self, datacenter, cluster, portgroup):
+        """Yield (host name, True if portgroup is on host) for cluster."""
+        _, missing = self.portgroup_matrix(datacenter, cluster, [portgroup])
+        for esxi, names in missing.items():
+            yield esxi, not names
+
+    def check_portgroup_configured(self, datacenter, cluster, portgroup):
+        """Check up whether portgroup is configured.
+
+        :param portgroup: name or pattern of portgroup, or list of them
+        """
+        portgroups = [portgroup] if isinstance(portgroup, str) else portgroup
+        _, missing = self.portgroup_matrix(datacenter, cluster, portgroups)
+        err = ["On esxi '{esxi}' portgroup(s) '{portgr}' not found".format(
+               esxi=esxi, portgr="', '".join(names))
+               for esxi, names in missing.items() if names]
         if err:
-            raise NotFoundException(err)
+            raise NotFoundException('\n'.join(err))
         return True
 
-    def check_storage_configured(self, datacenter, cluster, datastore):
-        """Check up whether datastore is configured on cluster."""
+    def datastore_matrix(self, datacenter, cluster, datastores=None):
+        """Return states of datastores on every host in cluster.
+
+        State is a dictionary with 'host', 'datastore' names and 'found',
+        'mounted', 'accessible' flags. The matrix is computed in one pass
+        over hosts datastores and datastores mounts.
+
+        :param datastores: names of datastores to check, all datastores of
+                           cluster hosts are checked if it is not set
+        :return: list of states, host by host
+        """
         dc = self.get_dc_object(datacenter)
         hosts = self.get_cluster_hosts_objects(dc, cluster)
 
-        err = {}
+        if datastores is None:
+            ds_ids = set()
+            for esxi in hosts:
+                ds_ids.update(esxi['datastore'])
+            columns = sorted(((ds['moid'], ds['name'])
+                              for ds in self.inventory.get_many(ds_ids)),
+                             key=lambda column: column[1])
+        else:
+            columns = []
+            for name in datastores:
+                ds = self.inventory.find('Datastore', name, dc['moid'])
+                columns.append((ds['moid'] if ds else None, name))
+
+        host_ids = {esxi['moid'] for esxi in hosts}
+        mounts = {}
+        for moid, _ in columns:
+            if moid is None:
+                continue
+            for mount in self.inventory.get(moid)['host']:
+                if mount['host'] in host_ids:
+                    mounts[mount['host'], moid] = mount
 
+        matrix = []
         for esxi in hosts:
-            for ds in esxi.datastore:
-                if ds.name == datastore:
-                    break
-            else:
-                log.error('ERROR: On esxi "{esxi}" datastore "{ds}" is not '
-                          'found'.format(esxi=esxi.name, ds=datastore))
-                err[0] = 'Some datastores not found'
-                continue
+            attached = set(esxi['datastore'])
+            for moid, name in columns:
+                mount = mounts.get((esxi['moid'], moid), {})
+                found = moid in attached
+                matrix.append({
+                    'host': esxi['name'],
+                    'datastore': name,
+                    'found': found,
+                    'mounted': found and mount.get('mounted', False),
+                    'accessible': found and mount.get('accessible', False),
+                })
+        return matrix
+
+    def datastore_states(self, datacenter, cluster, datastore):
+        """Yield state of datastore on every host in cluster."""
+        for state in self.datastore_matrix(datacenter, cluster, [datastore]):
+            yield state
 
-            for attached_host in ds.host:
-                if attached_host.key == esxi:
-                    break
+    def check_storage_configured(self, datacenter, cluster, datastore):
+        """Check up whether datastore is configured on cluster."""
+        err = {}
 
-            if attached_host.mountInfo.mounted:
-                log.info('On esxi "{esxi}" datastore "{ds}" is mounted'
-                         ''.format(ds=ds.name, esxi=esxi.name))
-            else:
-                log.error('ERROR: On esxi "{esxi}" datastore "{ds}" is NOT '
-                          'mounted'.format(ds=ds.name, esxi=esxi.name))
+        for state in self.datastore_states(datacenter, cluster, datastore):
+            if not state['found']:
+                err[0] = 'Some datastores not found'
+                continue
+            if not state['mounted']:
                 err[1] = 'Some datastores not mounted'
-
-            if attached_host.mountInfo.accessible:
-                log.info('On esxi "{esxi}" datastore "{ds}" is accessible'
-                         ''.format(ds=ds.name, esxi=esxi.name))
-            else:
-                log.error('ERROR: On esxi "{esxi}" datastore "{ds}" is NOT '
-                          'accessible'.format(ds=ds.name, esxi=esxi.name))
+            if not state['accessible']:
                 err[2] = 'Some datastores not accessible'
 
         if err:
-            raise NotFoundException('. '.join(err.values()))
+            raise NotFoundException('. '.join(
+                msg for _, msg in sorted(err.items())))
 
         return True
 
-    def write_test_datastore(self, datacenter, datastore, host):
-        """Put the file with test data to specified datastore."""
-        dc = self.get_dc_object(datacenter)
-        if datastore not in [ds.name for ds in dc.datastore]:
-            raise NotFoundException("Datastore '{ds}' not found on '{dc}' "
-                                    "datacenter".format(ds=datastore,
-                                                        dc=datacenter))
-
-        # Build the url to put the file - https://hostname:port/resource?params
-        resource = '/folder/test_upload'
-        params = {'dsName': datastore, 'dcPath': datacenter}
-        http_url = 'https://{vcenter}:443{resource}'.format(vcenter=host,
-                                                            resource=resource)
-
+    def _session_cookie(self):
+        """Return cookie of the current vCenter session for requests."""
         # Get the cookie built from the current session
         client_cookie = self._service_instance._stub.cookie
         # Break apart the cookie into it's component parts - This is more than
@@ -247,115 +1823,1181 @@ class Victl(object):
         # Make a cookie
         cookie = dict()
         cookie[cookie_name] = cookie_text
+        return cookie
+
+    def http_session(self):
+        """Return keep-alive HTTP session authenticated as vCenter session."""
+        cookie = self._session_cookie()
+        if getattr(self._http, 'cookie', None) != cookie:
+            self._http.session = requests.Session()
+            self._http.session.verify = False
+            self._http.session.cookies.update(cookie)
+            self._http.cookie = cookie
+        return self._http.session
+
+    def _datastore_url(self, host, datacenter, datastore, path):
+        """Return url and params of file on datastore."""
+        # Build the url to the file - https://hostname:port/resource?params
+        http_url = 'https://{vcenter}:{port}/folder/{path}'.format(
+            vcenter=host, port=self.port, path=path)
+        params = {'dsName': datastore, 'dcPath': datacenter}
+        return http_url, params
 
-        # Get the request headers set up
-        headers = {'Content-Type': 'application/octet-stream'}
+    def put_datastore_file(self, host, datacenter, datastore, path, data):
+        """Upload data to the file on datastore.
 
-        # Get the file to upload ready, extra protection by using with against
-        # leaving open threads
-        # Connect and upload the file
-        request = requests.put(http_url,
-                               params=params,
-                               data='Test upload file',
-                               headers=headers,
-                               cookies=cookie,
-                               verify=False)
+        :param data: string or iterable of chunks, chunks are sent with
+                     chunked transfer encoding
+        """
+        http_url, params = self._datastore_url(host, datacenter, datastore,
+                                               path)
+        headers = {'Content-Type': 'application/octet-stream'}
+        request = self.http_session().put(http_url, params=params, data=data,
+                                          headers=headers)
         if not request.ok:
+            raise Exception("Can not write file '{path}' to datastore "
+                            "'{ds}': {code}".format(path=path, ds=datastore,
+                                                    code=request.status_code))
+
+    def get_datastore_file(self, host, datacenter, datastore, path,
+                           chunk_size, byte_range=None):
+        """Yield chunks of the file on datastore.
+
+        :param byte_range: (first, last) bytes to read, whole file if unset
+        """
+        http_url, params = self._datastore_url(host, datacenter, datastore,
+                                               path)
+        headers = {}
+        if byte_range:
+            headers['Range'] = 'bytes={0}-{1}'.format(*byte_range)
+        request = self.http_session().get(http_url, params=params,
+                                          headers=headers, stream=True)
+        with request:
+            if not request.ok:
+                raise Exception("Can not read file '{path}' from datastore "
+                                "'{ds}': {code}".format(
+                                    path=path, ds=datastore,
+                                    code=request.status_code))
+            for chunk in request.iter_content(chunk_size):
+                yield chunk
+
+    def delete_datastore_file(self, host, datacenter, datastore, path):
+        """Remove the file from datastore."""
+        http_url, params = self._datastore_url(host, datacenter, datastore,
+                                               path)
+        self.http_session().delete(http_url, params=params)
+
+    def write_test_datastore(self, datacenter, datastore, host):
+        """Put the file with test data to specified datastore."""
+        dc = self.get_dc_object(datacenter)
+        self.get_datastore_object(dc, datastore)
+
+        try:
+            self.put_datastore_file(host, datacenter, datastore,
+                                    'test_upload', 'Test upload file')
+        except Exception:
             raise Exception("Can not write test file to datastore "
                             "'{ds}'".format(ds=datastore))
 
         return True
 
+    def datastore_check(self, datacenter, cluster, datastore):
+        """Write test file to datastore, return its states on cluster hosts.
+
+        :return: list of datastore_matrix states, host by host
+        :raise Exception: if test file can not be written
+        """
+        self.write_test_datastore(datacenter, datastore, self.host)
+        return self.datastore_matrix(datacenter, cluster, [datastore])
+
+
+def emit(args, text, level=log.INFO, output=False, **record):
+    """Report result as a text line or as a NDJSON record.
+
+    Results of a run over several vCenters are tagged with their vCenter.
+    Output goes to args.sink(logger, level, text) when it is set, so that
+    concurrent runs do not share logging handlers.
+
+    :param text: message for text output, nothing is printed if it is None
+    :param output: text is data for other programs, it goes to stdout
+    :param record: fields of the record, nothing is emitted if it is empty
+    """
+    source = getattr(args, 'vcenter', None)
+    if getattr(args, 'format', 'text') == 'ndjson':
+        if not record:
+            return
+        if source:
+            record['vcenter'] = source
+        logger, text = _records, json.dumps(record, sort_keys=True)
+    else:
+        if text is None:
+            return
+        if source:
+            text = '\n'.join('[{source}] {line}'.format(source=source,
+                                                        line=line)
+                             for line in text.split('\n'))
+        logger = _records if output else _log
+
+    sink = getattr(args, 'sink', None)
+    if sink:
+        sink(logger.name, level, text)
+    else:
+        logger.log(level, text)
+
 
 def cluster_list(args, inst):
     """Print list of clusters."""
     clusters = inst.get_clusters(args.datacenter)
     for cluster in clusters:
-        log.info(cluster)
+        emit(args, cluster, type='cluster', datacenter=args.datacenter,
+             cluster=cluster)
 
     return 0
 
 
 def check_dvs_attached(args, inst):
     """Return 0 if dvs is attached to hosts."""
-    dc = inst.get_dc_object(args.datacenter)
-    vds = inst.get_vds_object(dc, args.vdswitch)
-    hosts_in_cluster = inst.get_cluster_hosts(dc, args.cluster)
-    hosts_in_vds = inst.get_vds_hosts(args.datacenter, args.vdswitch)
+    states = inst.dvs_host_states(args.datacenter, args.cluster,
+                                  args.vdswitch, args.vmnic)
 
     # Check up whether all cluster hosts are in dvSwitch
-    host_not_in_vds = set(hosts_in_cluster) - set(hosts_in_vds)
-    if host_not_in_vds:
-        err = "In cluster '{cl_name}' on dvSwitch '{vds}' not found " \
-              "hosts:".format(cl_name=args.cluster, vds=args.vdswitch)
-        for host in host_not_in_vds:
-            err += "\n  {host}".format(host=host)
-        raise NotFoundException(err)
+    not_in_vds = [state for state in states if not state['member']]
+    for state in not_in_vds:
+        emit(args, None, log.ERROR, type='vds_host', **state)
+    if not_in_vds:
+        raise NotFoundException(
+            "In cluster '{cl_name}' on dvSwitch '{vds}' not found hosts:"
+            "{hosts}".format(cl_name=args.cluster, vds=args.vdswitch,
+                             hosts=''.join('\n  ' + state['host']
+                                           for state in not_in_vds)))
 
     # Check up whether all cluster hosts have vmnic attached
-    nics = inst.get_nics_for_hosts_in_vds(hosts_in_cluster, vds)
-    for hostname, host_nics in zip(hosts_in_cluster, nics):
-        if args.vmnic not in host_nics:
-            raise Exception("Host '{host}' has not attached nic '{nic}' to "
-                            "dvSwitch '{vds}'".format(host=hostname,
-                                                      nic=args.vmnic,
-                                                      vds=vds.name))
-        extra_nic = set(host_nics) - {args.vmnic}
-        if extra_nic:
-            log.info("Host '{host}' has extra nic '{nic}' attached to "
-                     "dvSwitch '{vds}'".format(host=hostname,
-                                               nic=','.join(extra_nic),
-                                               vds=vds.name))
-
+    for state in states:
+        emit(args, None, log.INFO if state['attached'] else log.ERROR,
+             type='vds_host', **state)
+        if state['extra_nics']:
+            emit(args, "Host '{host}' has extra nic '{nic}' attached to "
+                       "dvSwitch '{vds}'".format(
+                           nic=','.join(state['extra_nics']), **state))
+
+    not_attached = [state['host'] for state in states
+                    if not state['attached']]
+    if not_attached:
+        raise Exception("Host(s) '{hosts}' have not attached nic '{nic}' to "
+                        "dvSwitch '{vds}'".format(hosts="', '".join(
+                            not_attached), nic=args.vmnic,
+                            vds=args.vdswitch))
     return 0
 
 
-def check_esxi(args, inst):
-    """Return 0 if esxi is connected to controller."""
-    dc = inst.get_dc_object(args.datacenter)
-    hosts_in_cluster = inst.get_cluster_hosts(dc, args.cluster)
+def parse_net_maps(net_maps):
+    """Return list of (cluster, vds, active, standby) mappings.
 
-    # Check up whether esxi is connected to controller
-    for host in hosts_in_cluster:
-        if not inst.check_netcpad(host, args.user, args.password):
-            inst.restart_netcpad(host, args.user, args.password)
+    :param net_maps: vmware_dvs_net_maps value, mappings are separated by
+                     new lines or commas
+    """
+    maps = []
+    for line in re.split(r'[\n,]', net_maps.replace(' ', '')):
+        if not line:
+            continue
+        fields = line.split(':')
+        if len(fields) < 2 or len(fields) > 4:
+            raise Exception("Wrong mapping '{line}', expected format is "
+                            "Cluster:VDS:Active1;Active2:Standby1;Standby2"
+                            "".format(line=line))
+        active, standby = (fields[2:] + ['', ''])[:2]
+        maps.append((fields[0], fields[1],
+                     [uplink for uplink in active.split(';') if uplink],
+                     [uplink for uplink in standby.split(';') if uplink]))
+    return maps
+
+
+def check_net_maps(args, inst):
+    """Return 0 if all clusters are attached to dvSwitches as mapped."""
+    net_maps = parse_net_maps(args.netmaps)
+    inst.inventory  # load it once before workers share it
+
+    results = fan_out(
+        lambda net_map: inst.check_net_map(args.datacenter, *net_map),
+        net_maps, args.workers)
+
+    failed = 0
+    for (cluster, vds, active, standby), err, error in results:
+        if error:
+            err = [str(error)]
+        emit(args, "Cluster '{cl_name}' -> dvSwitch '{vds}' (active: "
+                   "{active}; standby: {standby}): {status}".format(
+                       cl_name=cluster, vds=vds,
+                       active=','.join(active) or '-',
+                       standby=','.join(standby) or '-',
+                       status='FAIL' if err else 'OK'),
+             type='net_map', cluster=cluster, vds=vds, active=active,
+             standby=standby, ok=not err, errors=err)
+        for msg in err:
+            emit(args, '  ERROR: {msg}'.format(msg=msg), log.ERROR)
+        failed += bool(err)
+
+    if failed:
+        raise Exception('{failed} of {total} mappings are not '
+                        'configured'.format(failed=failed,
+                                            total=len(net_maps)))
+    return 0
 
-            if inst.check_netcpad(host, args.user, args.password, True):
-                log.info('Host {host} reconnected to nsxv '
-                         'controller'.format(host=host))
-            else:
-                log.info('Host {host} NOT reconnected to nsxv '
-                         'controller'.format(host=host))
 
+def check_teaming(args, inst):
+    """Return 0 if portgroups use uplinks in order of the net maps."""
+    states = inst.teaming_states(args.datacenter,
+                                 parse_net_maps(args.netmaps))
+
+    drift = 0
+    for state in states:
+        emit(args, None, log.INFO if state['ok'] else log.ERROR,
+             type='teaming', **state)
+        if not state['ok']:
+            drift += 1
+            uplinks = {key: ','.join(state[key]) or '-'
+                       for key in ('active', 'standby', 'expected_active',
+                                   'expected_standby')}
+            emit(args, "ERROR: dvSwitch '{dvswitch}' portgroup "
+                       "'{portgroup}' uplinks active: {active}; standby: "
+                       "{standby}, expected active: {expected_active}; "
+                       "standby: {expected_standby}".format(
+                           **dict(state, **uplinks)),
+                 log.ERROR)
+
+    if drift:
+        raise Exception('{drift} of {total} portgroups do not follow the '
+                        'net maps'.format(drift=drift, total=len(states)))
+    emit(args, '{total} portgroups on {count} dvSwitch(es) follow the net '
+               'maps'.format(total=len(states), count=len(
+                   {state['dvswitch'] for state in states})))
+    return 0
+
+
+def check_esxi(args, inst):
+    """Return 0 if esxi is connected to controller."""
+    states = inst.esxi_states(args.datacenter, args.cluster, args.suser,
+                              args.spassword, int(args.timeout),
+                              args.workers)
+
+    failed = 0
+    for state in states:
+        if state['connected']:
+            emit(args, 'Host {host} reconnected to nsxv '
+                       'controller'.format(**state)
+                 if state['restarted'] else None, type='esxi', **state)
+        else:
+            failed += 1
+            emit(args, 'ERROR: Host {host} NOT reconnected to nsxv '
+                       'controller: {error}'.format(**state), log.ERROR,
+                 type='esxi', **state)
+
+    if failed:
+        raise Exception('{failed} of {total} hosts are not connected to nsxv '
+                        'controller'.format(failed=failed,
+                                            total=len(states)))
     return 0
 
 
 def check_portgroup(args, inst):
-    """Return 0 if portgroup is configured on cluster."""
-    if inst.check_portgroup_configured(args.datacenter, args.cluster,
-                                       args.portgroup):
-        return 0
+    """Return 0 if portgroups are configured on all hosts of cluster."""
+    portgroups = [name for name in args.portgroup.split(',') if name]
+    names, missing = inst.portgroup_matrix(args.datacenter, args.cluster,
+                                           portgroups)
+
+    failed = 0
+    for esxi, absent in missing.items():
+        for name in names:
+            emit(args, None, log.ERROR if name in absent else log.INFO,
+                 type='portgroup', host=esxi, portgroup=name,
+                 present=name not in absent)
+        if absent:
+            failed += 1
+            emit(args, "ERROR: On esxi '{esxi}' portgroup(s) '{portgr}' "
+                 "not found".format(esxi=esxi, portgr="', '".join(absent)),
+                 log.ERROR)
+
+    if failed:
+        raise NotFoundException(
+            '{failed} of {total} esxi miss some of {count} portgroup(s)'
+            ''.format(failed=failed, total=len(missing), count=len(names)))
+    emit(args, "{count} portgroup(s) are configured on all esxi in cluster "
+         "'{cl_name}'".format(count=len(names), cl_name=args.cluster))
+    return 0
 
 
 def check_datastore(args, inst):
     """Return 0 if datastore is configured on cluster."""
-    inst.write_test_datastore(args.datacenter, args.datastore, args.host)
-    if inst.check_storage_configured(args.datacenter, args.cluster,
-                                     args.datastore):
-        return 0
+    states = inst.datastore_check(args.datacenter, args.cluster,
+                                  args.datastore)
+
+    err = {}
+    for state in states:
+        msg = 'On esxi "{host}" datastore "{datastore}" is'.format(**state)
+        if not state['found']:
+            emit(args, 'ERROR: {msg} not found'.format(msg=msg), log.ERROR,
+                 type='datastore_state', **state)
+            err[0] = 'Some datastores not found'
+            continue
+
+        level = log.INFO if state['mounted'] and state['accessible'] \
+            else log.ERROR
+        emit(args, None, level, type='datastore_state', **state)
+
+        if state['mounted']:
+            emit(args, '{msg} mounted'.format(msg=msg))
+        else:
+            emit(args, 'ERROR: {msg} NOT mounted'.format(msg=msg), log.ERROR)
+            err[1] = 'Some datastores not mounted'
+
+        if state['accessible']:
+            emit(args, '{msg} accessible'.format(msg=msg))
+        else:
+            emit(args, 'ERROR: {msg} NOT accessible'.format(msg=msg),
+                 log.ERROR)
+            err[2] = 'Some datastores not accessible'
+
+    if err:
+        raise NotFoundException('. '.join(
+            msg for _, msg in sorted(err.items())))
+    return 0
+
+
+def _datastore_status(state):
+    """Return short status of datastore on host."""
+    if not state['found']:
+        return 'missing'
+    if not state['mounted']:
+        return 'unmounted'
+    if not state['accessible']:
+        return 'inaccessible'
+    return 'ok'
+
+
+def datastore_health(args, inst):
+    """Return 0 if datastores are mounted and accessible on cluster hosts.
+
+    Datastores which are not attached to a host are reported but fail the
+    check only if they are requested explicitly.
+    """
+    names = [name for name in (args.datastores or '').split(',') if name]
+    matrix = inst.datastore_matrix(args.datacenter, args.cluster,
+                                   names or None)
+
+    columns = []
+    rows = {}
+    failed = 0
+    for state in matrix:
+        status = _datastore_status(state)
+        if state['datastore'] not in columns:
+            columns.append(state['datastore'])
+        rows.setdefault(state['host'], []).append(status)
+
+        bad = status != 'ok' and (status != 'missing' or bool(names))
+        failed += bad
+        emit(args, None, log.ERROR if bad else log.INFO,
+             type='datastore_state', status=status, **state)
+
+    emit(args, "In cluster '{cl_name}'".format(cl_name=args.cluster))
+    width = max([len(name) for name in columns + list(rows)] +
+                [len('inaccessible'), len('esxi')]) + 2
+    for row in [['esxi'] + columns] + [[host] + statuses
+                                       for host, statuses in rows.items()]:
+        emit(args, '  ' + ''.join(cell.ljust(width) for cell in row).rstrip())
+
+    if failed:
+        raise Exception('{failed} datastore(s) are not mounted or not '
+                        'accessible on cluster hosts'.format(failed=failed))
+    return 0
+
+
+_bench_reads = 16  # ranged reads in every round of datastore benchmark
+
+
+def _percentile(values, percent):
+    """Return percentile of values using the nearest rank."""
+    values = sorted(values)
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def _bench_block(data, index):
+    """Return block of benchmark file, every block starts with its index."""
+    return struct.pack('>Q', index) + data[8:]
+
+
+def _bench_range(data, first, last):
+    """Return bytes of benchmark file between first and last offsets."""
+    block_size = len(data)
+    result = b''
+    index = first // block_size
+    while index * block_size <= last:
+        block = _bench_block(data, index)
+        start = max(first - index * block_size, 0)
+        end = min(last - index * block_size, block_size - 1)
+        result += block[start:end + 1]
+        index += 1
+    return result
+
+
+def _bench_datastore(args, inst, datastore, size, data, repeat):
+    """Return throughput and latency of datastore file operations."""
+    blocks = size // len(data)
+    path = 'victl_bench_{pid}.bin'.format(pid=os.getpid())
+    location = (args.host, args.datacenter, datastore, path)
+
+    expected = hashlib.sha256()
+    for index in range(blocks):
+        expected.update(_bench_block(data, index))
+    expected = expected.hexdigest()
+
+    upload, download, reads = [], [], []
+    checksum_ok = True
+    try:
+        for _ in range(repeat):
+            start = time.time()
+            inst.put_datastore_file(*location, data=(
+                _bench_block(data, index) for index in range(blocks)))
+            upload.append(time.time() - start)
+
+            start = time.time()
+            received = hashlib.sha256()
+            for chunk in inst.get_datastore_file(*location,
+                                                 chunk_size=len(data)):
+                received.update(chunk)
+            download.append(time.time() - start)
+            checksum_ok &= received.hexdigest() == expected
+
+            for _ in range(_bench_reads):
+                first = random.randint(0, size - len(data))
+                last = first + len(data) - 1
+                start = time.time()
+                chunk = b''.join(inst.get_datastore_file(
+                    *location, chunk_size=len(data),
+                    byte_range=(first, last)))
+                reads.append(time.time() - start)
+                checksum_ok &= chunk == _bench_range(data, first, last)
+    finally:
+        inst.delete_datastore_file(*location)
+
+    mbytes = size / 1024.0 / 1024
+    return {
+        'datastore': datastore,
+        'size_mb': round(mbytes, 1),
+        'upload_mbps': round(mbytes / _percentile(upload, 50), 1),
+        'download_mbps': round(mbytes / _percentile(download, 50), 1),
+        'upload_ms': {p: round(_percentile(upload, p) * 1000, 1)
+                      for p in (50, 90, 99)},
+        'download_ms': {p: round(_percentile(download, p) * 1000, 1)
+                        for p in (50, 90, 99)},
+        'range_read_ms': {p: round(_percentile(reads, p) * 1000, 1)
+                          for p in (50, 90, 99)},
+        'checksum_ok': checksum_ok,
+    }
+
+
+def datastore_bench(args, inst):
+    """Return 0 if data read back from datastores matches written data."""
+    if args.datastores:
+        datastores = [name for name in args.datastores.split(',') if name]
+    else:
+        datastores = sorted({state['datastore'] for state in
+                             inst.datastore_matrix(args.datacenter,
+                                                   args.cluster)})
+
+    block_size = int(args.block) * 1024
+    size = max(int(args.size) * 1024 * 1024 // block_size, 1) * block_size
+    data = os.urandom(block_size)
+
+    failed = []
+    for datastore in datastores:
+        inst.get_datastore_object(inst.get_dc_object(args.datacenter),
+                                  datastore)
+        result = _bench_datastore(args, inst, datastore, size, data,
+                                  int(args.repeat))
+        emit(args, "Datastore '{datastore}': upload {upload_mbps} MB/s, "
+                   "download {download_mbps} MB/s, range read "
+                   "p50 {reads[50]} ms p90 {reads[90]} ms p99 {reads[99]} ms, "
+                   "checksum {checksum}".format(
+                       reads=result['range_read_ms'],
+                       checksum='OK' if result['checksum_ok'] else 'FAIL',
+                       **result),
+             log.INFO if result['checksum_ok'] else log.ERROR,
+             type='datastore_bench', **result)
+        if not result['checksum_ok']:
+            failed.append(datastore)
+
+    if failed:
+        raise Exception('Data read back does not match written data on '
+                        'datastores: {ds}'.format(ds=', '.join(failed)))
+    return 0
+
+
+def portgroup_churn(args, inst):
+    """Return 0 if portgroups are created and destroyed in all batches."""
+    count = int(args.count)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',') if size]
+    if count < 1 or not batch_sizes or min(batch_sizes) < 1:
+        raise Exception('Number of portgroups and batch sizes must be at '
+                        'least 1')
+
+    best = None
+    for batch_size in batch_sizes:
+        churn = inst.churn_portgroups(args.datacenter, args.vdswitch, count,
+                                      batch_size, args.prefix,
+                                      float(args.timeout))
+        result = {
+            'batch_size': batch_size,
+            'count': count,
+            'create_per_s': round(count / churn['create_s'], 1),
+            'destroy_per_s': round(count / churn['destroy_s'], 1),
+            'create_ms': {p: round(_percentile(churn['create'], p) * 1000, 1)
+                          for p in (50, 90, 99)},
+            'destroy_ms': {p: round(_percentile(churn['destroy'], p) * 1000,
+                                    1)
+                           for p in (50, 90, 99)},
+        }
+        emit(args, "Batches of {batch_size}: create {create_per_s} "
+                   "portgroups/s, batch p50 {create[50]} ms p90 {create[90]} "
+                   "ms p99 {create[99]} ms; destroy {destroy_per_s} "
+                   "portgroups/s, batch p50 {destroy[50]} ms p90 "
+                   "{destroy[90]} ms p99 {destroy[99]} ms".format(
+                       create=result['create_ms'],
+                       destroy=result['destroy_ms'], **result),
+             type='portgroup_churn', dvswitch=args.vdswitch, **result)
+        if best is None or result['create_per_s'] > best['create_per_s']:
+            best = result
+
+    if best:
+        emit(args, "Best create throughput is {create_per_s} portgroups/s "
+                   "with batches of {batch_size}".format(**best))
+    return 0
 
 
 def datastore_list(args, inst):
     """Print list of datastores."""
     dc = inst.get_dc_object(args.datacenter)
     hosts = inst.get_cluster_hosts_objects(dc, args.cluster)
-    log.info("In cluster '{cl_name}'".format(cl_name=args.cluster))
+    emit(args, "In cluster '{cl_name}'".format(cl_name=args.cluster))
 
     for esxi in hosts:
-        log.info("  On esxi '{esxi}' datastores:".format(esxi=esxi.name))
+        emit(args, "  On esxi '{esxi}' datastores:".format(esxi=esxi['name']))
+
+        for ds in inst.inventory.names(esxi['datastore']):
+            emit(args, "    '{ds}'".format(ds=ds), type='datastore',
+                 cluster=args.cluster, host=esxi['name'], datastore=ds)
+
+    return 0
+
+
+def dvport_list(args, inst):
+    """Print ports of dvSwitch with their connectees and VLANs."""
+    flags = {'yes': True, 'no': False}
+    portgroups = [name for name in (args.portgroups or '').split(',')
+                  if name]
+    count = 0
+    for port in inst.dvports(args.datacenter, args.vdswitch,
+                             portgroups or None, flags.get(args.connected),
+                             flags.get(args.in_use), int(args.page_size)):
+        count += 1
+        connectee = '-' if port['connectee'] is None else \
+            '{connectee} {nic}'.format(**port)
+        emit(args, '  {key:>6}  {portgroup:<24} vlan {vlan:<10} '
+                   '{link:<4} {connectee}'.format(
+                       key=port['key'], portgroup=port['portgroup'],
+                       vlan='-' if port['vlan'] is None else port['vlan'],
+                       link='up' if port['link_up'] else 'down',
+                       connectee=connectee),
+             type='dvport', dvswitch=args.vdswitch, **port)
+
+    emit(args, "{count} port(s) on dvSwitch '{vds}'".format(
+        count=count, vds=args.vdswitch))
+    return 0
+
+
+# Version of dvSwitch snapshot layout
+_snapshot_format = 1
+
+
+def _dvs_topology(inventory, vds):
+    """Return uplinks, portgroups and hosts with nics of dvSwitch."""
+    hosts = {}
+    for member in vds['config.host']:
+        host = inventory.objects.get(member['host'])
+        if host:
+            hosts[host['name']] = sorted(member['pnics'])
+    return {
+        'uplinks': vds['config.uplinkPortPolicy'],
+        'portgroups': sorted(inventory.names(vds['portgroup'])),
+        'hosts': hosts,
+    }
+
+
+def _watch_view(inventory, moids):
+    """Return topology of dvSwitches and networks of hosts for moids.
+
+    dvSwitches which refer to changed hosts or portgroups are included, so
+    renames are seen in their topology as well.
+    """
+    dvswitches = {}
+    for vds in inventory.of_type('DistributedVirtualSwitch'):
+        refs = set(vds['portgroup']) | {member['host']
+                                        for member in vds['config.host']}
+        if vds['moid'] in moids or refs & moids:
+            dvswitches[vds['name']] = _dvs_topology(inventory, vds)
+
+    hosts = {host['name']: sorted(inventory.names(host['network']))
+             for host in inventory.get_many(moids)
+             if host['type'] == 'HostSystem'}
+    return {'dvswitches': dvswitches, 'hosts': hosts}
+
+
+def _watch_changes(before, after):
+    """Return changes between two views of watched objects."""
+    changes = diff_dvs_snapshots(before, after)
+
+    old_hosts = before['hosts']
+    new_hosts = after['hosts']
+    for host in sorted(set(old_hosts) - set(new_hosts)):
+        changes.append({'change': 'esxi_removed', 'host': host})
+    for host in sorted(set(new_hosts) - set(old_hosts)):
+        changes.append({'change': 'esxi_added', 'host': host,
+                        'networks': new_hosts[host]})
+    for host in sorted(set(old_hosts) & set(new_hosts)):
+        added = sorted(set(new_hosts[host]) - set(old_hosts[host]))
+        removed = sorted(set(old_hosts[host]) - set(new_hosts[host]))
+        if added or removed:
+            changes.append({'change': 'networks_changed', 'host': host,
+                            'added': added, 'removed': removed})
+    return changes
+
+
+def _pnic_owners(dvswitches):
+    """Return {(host, pnic): dvSwitch} for dvSwitches of snapshot."""
+    return {(host, pnic): name
+            for name, vds in dvswitches.items()
+            for host, pnics in vds['hosts'].items()
+            for pnic in pnics}
+
+
+def diff_dvs_snapshots(old, new):
+    """Return list of changes of dvSwitches topology between snapshots.
+
+    Change is a dictionary with its kind in 'change' and names of objects
+    it touches. Nic which is attached to other dvSwitch of the same host
+    is reported as moved, not as removed and added.
+    """
+    old_dvs = old['dvswitches']
+    new_dvs = new['dvswitches']
+    changes = []
+
+    for name in sorted(set(old_dvs) - set(new_dvs)):
+        changes.append({'change': 'dvswitch_removed', 'dvswitch': name})
+    for name in sorted(set(new_dvs) - set(old_dvs)):
+        changes.append({'change': 'dvswitch_added', 'dvswitch': name})
+
+    old_owners = _pnic_owners(old_dvs)
+    new_owners = _pnic_owners(new_dvs)
+    moved = {key for key in set(old_owners) & set(new_owners)
+             if old_owners[key] != new_owners[key]}
+    for host, pnic in sorted(moved):
+        changes.append({'change': 'pnic_moved', 'host': host, 'pnic': pnic,
+                        'dvswitch': new_owners[host, pnic],
+                        'previous': old_owners[host, pnic]})
+
+    for name in sorted(set(old_dvs) & set(new_dvs)):
+        before = old_dvs[name]
+        after = new_dvs[name]
+
+        if before['uplinks'] != after['uplinks']:
+            changes.append({'change': 'uplinks_changed', 'dvswitch': name,
+                            'uplinks': after['uplinks'],
+                            'previous': before['uplinks']})
+
+        for portgroup in sorted(set(before['portgroups']) -
+                                set(after['portgroups'])):
+            changes.append({'change': 'portgroup_removed', 'dvswitch': name,
+                            'portgroup': portgroup})
+        for portgroup in sorted(set(after['portgroups']) -
+                                set(before['portgroups'])):
+            changes.append({'change': 'portgroup_added', 'dvswitch': name,
+                            'portgroup': portgroup})
+
+        old_hosts = before['hosts']
+        new_hosts = after['hosts']
+        for host in sorted(set(old_hosts) - set(new_hosts)):
+            changes.append({'change': 'host_removed', 'dvswitch': name,
+                            'host': host, 'pnics': old_hosts[host]})
+        for host in sorted(set(new_hosts) - set(old_hosts)):
+            changes.append({'change': 'host_added', 'dvswitch': name,
+                            'host': host, 'pnics': new_hosts[host]})
+        for host in sorted(set(old_hosts) & set(new_hosts)):
+            if old_hosts[host] == new_hosts[host]:
+                continue
+            added = sorted(pnic for pnic in
+                           set(new_hosts[host]) - set(old_hosts[host])
+                           if (host, pnic) not in moved)
+            removed = sorted(pnic for pnic in
+                             set(old_hosts[host]) - set(new_hosts[host])
+                             if (host, pnic) not in moved)
+            if added or removed:
+                changes.append({'change': 'pnics_changed', 'dvswitch': name,
+                                'host': host, 'added': added,
+                                'removed': removed})
+    return changes
+
+
+# Text of changes in dvs-diff output
+_dvs_change_text = {
+    'dvswitch_removed': "dvSwitch '{dvswitch}' removed",
+    'dvswitch_added': "dvSwitch '{dvswitch}' added",
+    'pnic_moved': "Nic '{pnic}' of host '{host}' moved from dvSwitch "
+                  "'{previous}' to '{dvswitch}'",
+    'uplinks_changed': "dvSwitch '{dvswitch}' uplinks changed from "
+                       "{previous} to {uplinks}",
+    'portgroup_removed': "dvSwitch '{dvswitch}' portgroup '{portgroup}' "
+                         "removed",
+    'portgroup_added': "dvSwitch '{dvswitch}' portgroup '{portgroup}' added",
+    'host_removed': "Host '{host}' removed from dvSwitch '{dvswitch}' with "
+                    "nics {pnics}",
+    'host_added': "Host '{host}' added to dvSwitch '{dvswitch}' with nics "
+                  "{pnics}",
+    'pnics_changed': "Host '{host}' on dvSwitch '{dvswitch}' nics added "
+                     "{added}, removed {removed}",
+    'esxi_removed': "Host '{host}' removed",
+    'esxi_added': "Host '{host}' added with networks {networks}",
+    'networks_changed': "Host '{host}' networks added {added}, removed "
+                        "{removed}",
+}
+
+
+def dvs_snapshot(args, inst):
+    """Save topology of dvSwitches in datacenter to the snapshot file."""
+    snapshot = inst.dvs_snapshot(args.datacenter)
+    if args.snapshot == '-':
+        emit(args, json.dumps(snapshot, sort_keys=True), output=True,
+             type='dvs_snapshot', path=args.snapshot,
+             dvswitches=len(snapshot['dvswitches']), snapshot=snapshot)
+    else:
+        with open(args.snapshot, 'w') as output:
+            json.dump(snapshot, output, sort_keys=True)
+        emit(args, "Snapshot of {count} dvSwitch(es) saved to '{path}'".format(
+            count=len(snapshot['dvswitches']), path=args.snapshot),
+            type='dvs_snapshot', path=args.snapshot,
+            dvswitches=len(snapshot['dvswitches']))
+    return 0
+
+
+def dvs_diff(args, inst):
+    """Return 0 if dvSwitches did not change between two snapshots."""
+    snapshots = []
+    for path in (args.previous, args.snapshot):
+        with (sys.stdin if path == '-' else open(path)) as snapshot:
+            snapshots.append(json.load(snapshot))
+        if snapshots[-1].get('format') != _snapshot_format:
+            raise Exception("Snapshot '{path}' has unknown format".format(
+                path=path))
+
+    changes = diff_dvs_snapshots(*snapshots)
+    for change in changes:
+        emit(args, _dvs_change_text[change['change']].format(**change),
+             type='dvs_change', **change)
+
+    if changes:
+        emit(args, '{count} change(s) of dvSwitches'.format(
+            count=len(changes)))
+        return 1
+    emit(args, 'No changes of dvSwitches')
+    return 0
+
+
+def watch(args, inst):
+    """Print changes of dvSwitches and host networks as they happen."""
+    duration = float(args.duration) or None
+    emit(args, "Watching dvSwitches in datacenter '{dc}'".format(
+        dc=args.datacenter))
+    try:
+        for changes in inst.watch_dvs(args.datacenter, int(args.timeout),
+                                      duration):
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S')
+            for change in changes:
+                emit(args, '{stamp} {text}'.format(
+                    stamp=stamp,
+                    text=_dvs_change_text[change['change']].format(**change)),
+                    type='dvs_change', time=stamp, **change)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _csv_line(values):
+    """Return values as one CSV line, None is an empty field."""
+    line = io.StringIO()
+    csv.writer(line, lineterminator='').writerow(values)
+    return line.getvalue()
+
+
+def perf(args, inst):
+    """Print realtime network counters of vmnics and dvSwitch ports.
+
+    Text output is CSV with a header line on stdout, with ndjson the first
+    record lists counters with their units.
+    """
+    counters = inst.perf_counters(
+        [name for name in args.counters.split(',') if name])
+    columns = ['time', 'kind', 'host', 'dvswitch', 'port', 'entity',
+               'instance'] + list(counters)
+    emit(args, _csv_line(columns), output=True, type='perf_counters',
+         counters=[{'name': name, 'key': info.key,
+                    'unit': info.unitInfo.key}
+                   for name, info in counters.items()])
+    try:
+        for samples in inst.perf_samples(
+                args.datacenter, args.cluster, counters,
+                int(args.query_size), float(args.duration) or None,
+                int(args.page_size)):
+            for sample in samples:
+                emit(args, _csv_line([sample.get(column)
+                                      for column in columns]),
+                     output=True, type='perf', **sample)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_func(args, inst):
+    """Run function chosen in args and return its exit code."""
+    try:
+        res = args.func(args, inst) or 0
+    except Exception as e:
+        emit(args, 'ERROR: {msg}'.format(msg=e), log.ERROR, type='error',
+             command=args.command, message=str(e))
+        res = 1
+
+    emit(args, None, type='exit', command=args.command, status=res)
+    return res
+
+
+def load_vcenters(path):
+    """Return list of vCenters with credentials from JSON file.
+
+    The file holds a list of compute entries of VMware settings or an
+    object with them under 'computes'. Every entry has 'vc_host',
+    'vc_user' and 'vc_password', 'vc_port' and 'datacenter' are optional.
+    Entries of the same vCenter are merged, the first one is used.
+    """
+    with open(path) as vcenters_file:
+        computes = json.load(vcenters_file)
+    if isinstance(computes, dict):
+        computes = computes.get('computes', [])
+
+    vcenters = []
+    seen = set()
+    for index, compute in enumerate(computes):
+        missing = [key for key in ('vc_host', 'vc_user', 'vc_password')
+                   if not compute.get(key)]
+        if missing:
+            raise Exception('vCenter entry {entry} of {path} has no '
+                            '{keys}'.format(entry=index + 1, path=path,
+                                            keys=', '.join(missing)))
+        key = (compute['vc_host'], compute.get('vc_port'))
+        if key not in seen:
+            seen.add(key)
+            vcenters.append(compute)
+    if not vcenters:
+        raise Exception('No vCenters in {path}'.format(path=path))
+    return vcenters
+
+
+def _vcenter_args(args, vcenter):
+    """Return copy of args which connects to vCenter of the list."""
+    vc_args = argparse.Namespace(**vars(args))
+    vc_args.vcenter = vcenter['vc_host']
+    vc_args.host = vcenter['vc_host']
+    vc_args.user = vcenter['vc_user']
+    vc_args.password = vcenter['vc_password']
+    vc_args.port = vcenter.get('vc_port', args.port)
+    vc_args.datacenter = vcenter.get('datacenter', args.datacenter)
+    # files are kept per vCenter, stdout is shared
+    for name in ('cache', 'session', 'snapshot'):
+        if getattr(args, name, None) not in (None, '-'):
+            setattr(vc_args, name, '{path}.{host}'.format(
+                path=getattr(args, name), host=vc_args.host))
+    return vc_args
+
+
+def run_vcenters(args, soap_stats=None):
+    """Run function chosen in args against every vCenter of the list.
+
+    Every vCenter gets its own session and worker, so the run takes as
+    long as the slowest vCenter. Results are tagged with their vCenter.
+
+    :return: the worst exit code
+    """
+    vcenters = load_vcenters(args.vcenters)
+    if getattr(args, 'script', None) == '-':
+        # stdin is read once for all vCenters
+        args.script_lines = sys.stdin.readlines()
+
+    def run(vcenter):
+        vc_args = _vcenter_args(args, vcenter)
+        try:
+            inst = Victl(vc_args.host, vc_args.user, vc_args.password,
+                         vc_args.port, vc_args.cache, soap_stats,
+                         vc_args.session)
+        except Exception as e:
+            emit(vc_args, 'ERROR: {msg}'.format(msg=e), log.ERROR,
+                 type='error', command=args.command, message=str(e))
+            return 1
+        try:
+            return run_func(vc_args, inst)
+        finally:
+            inst.close()
+
+    results = fan_out(run, vcenters, len(vcenters))
+    failed = [vcenter['vc_host'] for vcenter, res, error in results
+              if error or res]
+    for vcenter, _, error in results:
+        if error:
+            emit(args, 'ERROR: [{host}] {msg}'.format(
+                host=vcenter['vc_host'], msg=error), log.ERROR, type='error',
+                command=args.command, vcenter=vcenter['vc_host'],
+                message=str(error))
+    emit(args, '{command} failed on {failed} of {total} '
+               'vCenters{hosts}'.format(
+                   command=args.command, failed=len(failed),
+                   total=len(vcenters),
+                   hosts=': ' + ', '.join(failed) if failed else ''),
+         log.ERROR if failed else log.INFO, type='vcenters',
+         command=args.command, total=len(vcenters), failed=failed)
+    return max([res or (1 if error else 0) for _, res, error in results])
+
+
+def _batch_argv(line, args):
+    """Return argv for batch line, connection comes from batch args."""
+    argv = shlex.split(line)
+    if argv and argv[0] == 'batch':
+        raise Exception('Nested batch is not supported')
+
+    # datacenter and format can be overridden by the line, connection can not
+    params = _functions[argv[0]]['params'] if argv and \
+        argv[0] in _functions else _common_params
+    head = []
+    for name in ('datacenter', 'format'):
+        if name in params:
+            head += ['--' + name, getattr(args, name)]
+    tail = []
+    if 'host' in params:
+        tail = ['--host', args.host, '--port', str(args.port),
+                '--user', args.user, '--password', args.password]
+    return argv[:1] + head + argv[1:] + tail
+
+
+def batch(args, inst):
+    """Run commands from script over one connection, 0 if all succeed."""
+    if getattr(args, 'script_lines', None) is not None:
+        lines = args.script_lines
+    elif args.script == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.script) as script:
+            lines = script.readlines()
+
+    results = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        emit(args, '{t}{s}\n{t}{line}'.format(line=line, **_ft))
+        try:
+            line_args = _parse_args(_batch_argv(line, args))
+            line_args.vcenter = getattr(args, 'vcenter', None)
+            line_args.sink = getattr(args, 'sink', None)
+            res = run_func(line_args, inst)
+        except SystemExit as e:  # argparse reports wrong arguments so
+            res = e.code
+        except Exception as e:
+            emit(args, 'ERROR: {msg}'.format(msg=e), log.ERROR, type='error',
+                 command=line, message=str(e))
+            res = 1
+        results.append((res, line))
+        emit(args, None, type='batch_command', command=line, status=res)
+
+    emit(args, '{t}{s}'.format(**_ft))
+    for res, line in results:
+        emit(args, '{t}{status:<6} {line}'.format(
+            status='OK' if res == 0 else 'FAIL', line=line, **_ft))
+
+    failed = len([res for res, _ in results if res != 0])
+    emit(args, '{t}{total} commands, {failed} failed'.format(
+        total=len(results), failed=failed, **_ft))
+
+    return 1 if failed else 0
+
+
+# Functions which can be run by victl server for clients
+_served_funcs = ['cluster-list', 'check-dvs-attached', 'check-net-maps',
+                 'check-esxi', 'check-portgroup', 'check-datastore',
+                 'datastore-health', 'datastore-list', 'check-teaming']
+
+_keepalive = 300  # seconds between session keepalive calls of idle server
+
+
+def _send_message(wfile, message):
+    """Write one JSON message line to the socket file."""
+    wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+    wfile.flush()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Run one victl command for a client.
+
+    Request is a JSON line with 'argv' and client 'env' variables. Response
+    is a sequence of JSON lines with log records, the last one contains
+    'status' of the command or the reason why it is 'refused' by server.
+    """
+
+    def handle(self):
+        """Parse request and run the command."""
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            args = self.server.parse_request(request['argv'],
+                                             request.get('env', {}))
+        except SystemExit:  # argparse rejected arguments
+            _send_message(self.wfile, {'refused': 'Invalid arguments'})
+            return
+        except Exception as e:
+            _send_message(self.wfile, {'refused': str(e)})
+            return
+
+        # output of this command goes to its own client only
+        args.sink = lambda name, level, text: _send_message(
+            self.wfile, {'logger': name, 'level': level, 'message': text})
+        self.server.refresh()
+        res = run_func(args, self.server.inst)
+
+        _send_message(self.wfile, {'status': res})
+
+
+class _VictlServer(socketserver.UnixStreamServer):
+    """Serve victl commands over one warm vCenter session."""
+
+    timeout = _keepalive
+
+    def __init__(self, path, inst):
+        """Bind to the socket path, only owner can connect."""
+        self.inst = inst
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path,
+                                                   _RequestHandler)
+        finally:
+            os.umask(umask)
+
+    def parse_request(self, argv, env):
+        """Return parsed args if command can be run on this session."""
+        if not argv or argv[0] not in _served_funcs:
+            raise Exception('Command is not served')
+
+        # flags from client environment go first, explicit ones override
+        env_argv = []
+        for name in _functions[argv[0]]['params']:
+            env_var = _func_args[name]['env_var']
+            if env_var and env_var in env:
+                env_argv += ['--' + name, env[env_var]]
+
+        args = _parse_args(argv[:1] + env_argv + argv[1:])
+        if getattr(args, 'vcenters', None):
+            raise Exception('Commands for a list of vCenters are not served')
+        inst = self.inst
+        if (args.host, args.user, args.password, str(args.port)) != \
+                (inst.host, inst.user, inst.password, str(inst.port)):
+            raise Exception('Server is connected to other vCenter')
+        # the session of server has its own cache and SOAP statistics
+        if args.cache and args.cache != inst.cache:
+            raise Exception('Server keeps inventory in other cache')
+        if args.soap_stats:
+            raise Exception('SOAP statistics of a command are not served')
+
+        return args
+
+    def refresh(self):
+        """Bring inventory up to date, log in again if session expired."""
+        try:
+            self.inst.refresh_inventory()
+        except vim.fault.NotAuthenticated:
+            self.inst.connect()
+            self.inst.refresh_inventory()
+
+    def handle_timeout(self):
+        """Keep vCenter session alive while there are no requests."""
+        try:
+            self.inst._service_instance.CurrentTime()
+        except vim.fault.NotAuthenticated:
+            self.inst.connect()
+
+
+def _socket_alive(path):
+    """Return True if somebody listens on UNIX socket."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        client.close()
+
+
+def call_server(path, argv):
+    """Run command on victl server, return None if it can not be served."""
+    env = {name: environ[name] for name in _env_vars if name in environ}
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except socket.error:
+        client.close()
+        return None
+
+    with client, client.makefile('rwb') as sock_file:
+        _send_message(sock_file, {'argv': argv, 'env': env})
+        for line in sock_file:
+            message = json.loads(line.decode('utf-8'))
+            if 'message' in message:
+                log.getLogger(message.get('logger')).log(message['level'],
+                                                         message['message'])
+            elif 'status' in message:
+                return message['status']
+            else:
+                _log.debug('Server refused command: {reason}'.format(
+                    reason=message.get('refused')))
+                return None
 
-        for ds in esxi.datastore:
-            log.info("    '{ds}'".format(ds=ds.name))
+    return None
+
+
+def serve(args, inst):
+    """Serve commands on UNIX socket until interrupted."""
+    if os.path.exists(args.socket):
+        if _socket_alive(args.socket):
+            raise Exception("Server is already running on "
+                            "'{path}'".format(path=args.socket))
+        os.unlink(args.socket)
+
+    server = _VictlServer(args.socket, inst)
+    emit(args, "Serving on '{path}'".format(path=args.socket), type='serve',
+         socket=args.socket)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.refresh()
+        while True:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
 
     return 0
 
@@ -379,7 +3021,7 @@ def setup_env_var(name):
 
 
 def setup_arg(name, short_flag, help, required=True, default=None,
-              env_var=None, example=None):
+              env_var=None, example=None, choices=None):
     """Save parameter info to the _func_args dictionary."""
     _func_args[name] = {
         'short_flag': short_flag,
@@ -389,6 +3031,7 @@ def setup_arg(name, short_flag, help, required=True, default=None,
         'help': help,
         'env_var': env_var,
         'example': example,
+        'choices': choices,
     }
 
 
@@ -398,6 +3041,12 @@ v_passw = setup_env_var('VCENTER_PASSWORD')
 v_dcenter = setup_env_var('VC_DATACENTER')
 v_datastore = setup_env_var('VC_DATASTORE')
 v_cluster = setup_env_var('VC_CLUSTER')
+v_cache = setup_env_var('VICTL_CACHE')
+v_socket = setup_env_var('VICTL_SOCKET')
+v_soapstats = setup_env_var('VICTL_SOAP_STATS')
+v_session = setup_env_var('VICTL_SESSION')
+v_vcenters = setup_env_var('VICTL_VCENTERS')
+v_netmaps = setup_env_var('VMWARE_DVS_NET_MAPS')
 
 
 setup_arg(name='host',
@@ -430,6 +3079,56 @@ setup_arg(name='port',
           required=False,
           default=443)
 
+setup_arg(name='cache',
+          short_flag='C',
+          help='File to keep vCenter inventory in between runs, only '
+               'changes are fetched when it is valid; the vCenter session '
+               'is kept in the file with .session suffix unless --session '
+               'is set',
+          env_var=v_cache,
+          required=False,
+          default=_env_vars[v_cache] or None,
+          example='/tmp/victl-inventory.json')
+
+setup_arg(name='vcenters',
+          short_flag='V',
+          help='JSON file with a list of vCenters with vc_host, vc_user and '
+               'vc_password as in compute entries of VMware settings, the '
+               'command is run against all of them concurrently instead of '
+               '--host',
+          env_var=v_vcenters,
+          required=False,
+          default=_env_vars[v_vcenters] or None,
+          example='/tmp/vcenters.json')
+
+setup_arg(name='session',
+          short_flag='K',
+          help='File to keep vCenter session cookie in between runs, the '
+               'session is reused while it is valid and is not logged out '
+               'at exit',
+          env_var=v_session,
+          required=False,
+          default=_env_vars[v_session] or None,
+          example='/tmp/victl-session.json')
+
+setup_arg(name='soap_stats',
+          short_flag='T',
+          help="Record SOAP calls to vCenter per method and per managed "
+               "object type, the JSON report is written to the file at "
+               "exit, with '-' a summary is logged instead",
+          env_var=v_soapstats,
+          required=False,
+          default=_env_vars[v_soapstats] or None,
+          example='/tmp/victl-soap.json')
+
+setup_arg(name='format',
+          short_flag='F',
+          help='Output format, with ndjson a JSON record per line is '
+               'written to stdout for every result as it is produced',
+          required=False,
+          default='text',
+          choices=['text', 'ndjson'])
+
 setup_arg(name='datacenter',
           short_flag='d',
           help='Datacenter, which cluster exists',
@@ -459,10 +3158,34 @@ setup_arg(name='vmnic',
 
 setup_arg(name='portgroup',
           short_flag='g',
-          help='Portgroup name, which must be configured on all esxi in '
-               'vcenter cluster',
+          help='Comma separated names or shell-style patterns of '
+               'portgroups, which must be configured on all esxi in vcenter '
+               'cluster',
           required=True,
-          example='br100')
+          example='br100,br-*')
+
+setup_arg(name='netmaps',
+          short_flag='m',
+          help='vmware_dvs_net_maps value with Cluster:VDS:Active:Standby '
+               'mappings separated by new lines or commas',
+          env_var=v_netmaps,
+          required=not _env_vars[v_netmaps],
+          default=_env_vars[v_netmaps],
+          example='Cluster1:dvSwitch:dvUplink1;dvUplink2:dvUplink3')
+
+setup_arg(name='workers',
+          short_flag='w',
+          help='Maximum number of checks run concurrently',
+          required=False,
+          default=8)
+
+setup_arg(name='timeout',
+          short_flag='t',
+          help='Seconds to wait for a command on esxi host, for a vCenter '
+               'task or for changes in vCenter before watch checks its '
+               'duration, at least 1 for watch',
+          required=False,
+          default=30)
 
 setup_arg(name='datastore',
           short_flag='ds',
@@ -472,6 +3195,132 @@ setup_arg(name='datastore',
           env_var=v_datastore,
           example='nfs')
 
+setup_arg(name='script',
+          short_flag='f',
+          help='File with victl commands one per line, they are run over '
+               'one vCenter connection, "-" reads them from stdin',
+          required=False,
+          default='-',
+          example='checks.txt')
+
+setup_arg(name='socket',
+          short_flag='S',
+          help='UNIX socket of victl server, commands are forwarded to the '
+               'server when it is exported and the server is running, '
+               'commands with a list of vCenters, other cache or SOAP '
+               'statistics are run locally',
+          env_var=v_socket,
+          required=not _env_vars[v_socket],
+          default=_env_vars[v_socket],
+          example='/tmp/victl.sock')
+
+setup_arg(name='snapshot',
+          short_flag='sn',
+          help='File with snapshot of dvSwitches topology, "-" is stdout '
+               'for dvs-snapshot and stdin for dvs-diff',
+          required=False,
+          default='-',
+          example='dvs-after.json')
+
+setup_arg(name='previous',
+          short_flag='pv',
+          help='File with snapshot of dvSwitches topology to compare with',
+          required=True,
+          example='dvs-before.json')
+
+setup_arg(name='duration',
+          short_flag='du',
+          help='Seconds to watch for changes or collect samples, 0 runs '
+               'until interrupted',
+          required=False,
+          default=0,
+          example='3600')
+
+setup_arg(name='datastores',
+          short_flag='dss',
+          help='Comma separated datastores to check, all datastores of '
+               'cluster hosts if it is not set',
+          required=False,
+          example='nfs,datastore1')
+
+setup_arg(name='portgroups',
+          short_flag='gs',
+          help='Comma separated names or shell-style patterns of '
+               'portgroups to list ports of, all portgroups if it is not set',
+          required=False,
+          example='br100,br-*')
+
+setup_arg(name='connected',
+          short_flag='cn',
+          help='List only ports which are connected to a virtual machine '
+               'or host nic or only ports which are not',
+          required=False,
+          choices=['yes', 'no'])
+
+setup_arg(name='in_use',
+          short_flag='iu',
+          help='List only ports which are in use or only ports which are '
+               'not',
+          required=False,
+          choices=['yes', 'no'])
+
+setup_arg(name='page_size',
+          short_flag='ps',
+          help='Number of ports fetched from vCenter in one call',
+          required=False,
+          default=500)
+
+setup_arg(name='counters',
+          short_flag='cs',
+          help='Comma separated performance counters as group.name.rollup',
+          required=False,
+          default=','.join(_perf_counters))
+
+setup_arg(name='query_size',
+          short_flag='qs',
+          help='Number of entities queried in one QueryPerf call, vCenter '
+               'limits metrics of a query by vpxd.stats.maxQueryMetrics',
+          required=False,
+          default=64)
+
+setup_arg(name='count',
+          short_flag='k',
+          help='Number of portgroups to create and destroy for every batch '
+               'size',
+          required=False,
+          default=100)
+
+setup_arg(name='batch_sizes',
+          short_flag='bs',
+          help='Comma separated numbers of portgroups created by one task',
+          required=False,
+          default='1,10,50')
+
+setup_arg(name='prefix',
+          short_flag='px',
+          help='Prefix of names of test portgroups, the run does not start '
+               'if dvSwitch already has portgroups with these names',
+          required=False,
+          default='victl-churn')
+
+setup_arg(name='size',
+          short_flag='sz',
+          help='Size of benchmark file in MB',
+          required=False,
+          default=64)
+
+setup_arg(name='block',
+          short_flag='b',
+          help='Size of upload chunks and ranged reads in KB',
+          required=False,
+          default=1024)
+
+setup_arg(name='repeat',
+          short_flag='r',
+          help='How many times benchmark is repeated',
+          required=False,
+          default=3)
+
 setup_arg(name='suser',
           short_flag='su',
           help='User name fot connect via ssh to esxi host',
@@ -488,14 +3337,19 @@ setup_arg(name='spassword',
 _functions = {}  # information about functions
 
 
-def setup_func(name, params, func):
-    """Save function info to the _functions dictionary."""
+def setup_func(name, params, func, connect=True):
+    """Save function info to the _functions dictionary.
+
+    :param connect: False if function works without vCenter
+    """
     _functions[name] = {
         'params': params,
-        'func': func
+        'func': func,
+        'connect': connect
     }
 
-_common_params = ['host', 'port', 'user', 'password', 'datacenter']
+_common_params = ['host', 'port', 'user', 'password', 'vcenters',
+                  'datacenter', 'cache', 'session', 'format', 'soap_stats']
 
 
 setup_func(name='cluster-list',
@@ -506,8 +3360,17 @@ setup_func(name='check-dvs-attached',
            params=_common_params + ['cluster', 'vdswitch', 'vmnic'],
            func=check_dvs_attached)
 
+setup_func(name='check-net-maps',
+           params=_common_params + ['netmaps', 'workers'],
+           func=check_net_maps)
+
+setup_func(name='check-teaming',
+           params=_common_params + ['netmaps'],
+           func=check_teaming)
+
 setup_func(name='check-esxi',
-           params=_common_params + ['cluster', 'suser', 'spassword'],
+           params=_common_params + ['cluster', 'suser', 'spassword',
+                                    'workers', 'timeout'],
            func=check_esxi)
 
 setup_func(name='check-portgroup',
@@ -518,10 +3381,57 @@ setup_func(name='check-datastore',
            params=_common_params + ['cluster', 'datastore'],
            func=check_datastore)
 
+setup_func(name='datastore-health',
+           params=_common_params + ['cluster', 'datastores'],
+           func=datastore_health)
+
+setup_func(name='datastore-bench',
+           params=_common_params + ['cluster', 'datastores', 'size', 'block',
+                                    'repeat'],
+           func=datastore_bench)
+
 setup_func(name='datastore-list',
            params=_common_params + ['cluster'],
            func=datastore_list)
 
+setup_func(name='dvport-list',
+           params=_common_params + ['vdswitch', 'portgroups', 'connected',
+                                    'in_use', 'page_size'],
+           func=dvport_list)
+
+setup_func(name='portgroup-churn',
+           params=_common_params + ['vdswitch', 'count', 'batch_sizes',
+                                    'prefix', 'timeout'],
+           func=portgroup_churn)
+
+setup_func(name='dvs-snapshot',
+           params=_common_params + ['snapshot'],
+           func=dvs_snapshot)
+
+setup_func(name='dvs-diff',
+           params=['format', 'previous', 'snapshot'],
+           func=dvs_diff,
+           connect=False)
+
+setup_func(name='watch',
+           params=_common_params + ['timeout', 'duration'],
+           func=watch)
+
+setup_func(name='perf',
+           params=_common_params + ['cluster', 'counters', 'query_size',
+                                    'duration', 'page_size'],
+           func=perf)
+
+setup_func(name='batch',
+           params=_common_params + ['script'],
+           func=batch)
+
+# server keeps a single vCenter session
+setup_func(name='serve',
+           params=[name for name in _common_params if name != 'vcenters'] +
+           ['socket'],
+           func=serve)
+
 
 def _form_env_help():
     """Return message about exported and available env variables."""
@@ -560,8 +3470,6 @@ def _form_env_help():
 
     return exported, available
 
-_env_vars_msg, _env_available = _form_env_help()
-
 
 def _form_func_help(func_name, with_env=True):
     """Return example of usage for function.
@@ -605,75 +3513,169 @@ def _form_func_help(func_name, with_env=True):
                     flag='-' + params['short_flag'],
                     example=params['example'] or params['default']
                 )
-        msg += func_call + rest_args + _env_vars_msg
+        msg += func_call + rest_args + _form_env_help()[0]
 
     return msg
 
 
-def _def_parser(func_name):
-    """Return subparser with func_name and func_args_names parameters."""
-    func_params = _functions[func_name]['params']
+class _LazyHelpParser(argparse.ArgumentParser):
+    """Argument parser which forms its epilog only when help is printed."""
+
+    def __init__(self, *args, **kwargs):
+        """Save function which returns epilog.
+
+        :param epilog_func: function without arguments returning epilog
+        """
+        self.epilog_func = kwargs.pop('epilog_func', None)
+        self.func_parsers = {}  # subparsers with arguments by command
+        super(_LazyHelpParser, self).__init__(*args, **kwargs)
+
+    def format_help(self):
+        """Form epilog and return help message."""
+        if self.epilog_func:
+            self.epilog = textwrap.indent(self.epilog_func(), '')
+            self.epilog_func = None
+        return super(_LazyHelpParser, self).format_help()
+
 
-    help_msg = '{t}{s}\n' \
-               '{t}Examples of usage:\n' \
-               '{func_call}'.\
+def _form_func_epilog(func_name):
+    """Return epilog of subparser with examples of usage."""
+    return '{t}{s}\n' \
+           '{t}Examples of usage:\n' \
+           '{func_call}'.\
         format(func_call=_form_func_help(func_name), **_ft)
 
-    sub_parser = _subparser.add_parser(
+
+# Connection parameters which are not needed with a list of vCenters
+_connection_params = ['host', 'user', 'password']
+
+
+def _def_parser(subparser, func_name):
+    """Return subparser with func_name and func_args_names parameters."""
+    func_params = _functions[func_name]['params']
+    # they are checked after parsing, see _check_connection_args
+    optional = _connection_params if 'vcenters' in func_params else []
+
+    sub_parser = subparser.add_parser(
         func_name, formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog=textwrap.indent(help_msg, '')
+        epilog_func=lambda: _form_func_epilog(func_name)
     )
 
     for arg in sorted(func_params):
         params = _func_args.get(arg, None)
         sub_parser.add_argument('-{flag}'.format(flag=params['short_flag']),
                                 '--{flag}'.format(flag=params['long_flag']),
-                                required=params.get('required', True),
+                                required=params.get('required', True) and
+                                arg not in optional,
                                 default=params['default'],
+                                choices=params['choices'],
                                 help=params['help'])
 
-    sub_parser.set_defaults(func=_functions[func_name]['func'])
+    sub_parser.set_defaults(func=_functions[func_name]['func'],
+                            command=func_name)
 
     return sub_parser
 
 
 def _form_help_msg():
     """Return usage message for the program."""
+    env_vars_msg, env_available = _form_env_help()
     msg = '\n{t}{s}\n' \
           '{t}You can use these environment variables:\n' \
           '{vars}\n' \
           '{t}{s}\n' \
-          '{t}Examples of usage:\n'.format(vars=_env_available, **_ft)
+          '{t}Examples of usage:\n'.format(vars=env_available, **_ft)
 
     for func in sorted(_functions):
         msg += _form_func_help(func, False) + '\n\n'
 
-    msg += _env_vars_msg
+    msg += env_vars_msg
 
     return msg
 
 
-_parser = argparse.ArgumentParser(
-    formatter_class=argparse.RawDescriptionHelpFormatter,
-    epilog=textwrap.indent(_form_help_msg(), '')
-)
-_subparser = _parser.add_subparsers()
+def _build_parser(func_name=None):
+    """Return parser, only func_name subparser gets arguments if it is set.
+
+    The rest of subparsers are left empty, they are needed for the list of
+    choices only.
+    """
+    parser = _LazyHelpParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog_func=_form_help_msg
+    )
+    subparser = parser.add_subparsers()
+
+    for func in _functions:
+        if func_name in (None, func):
+            parser.func_parsers[func] = _def_parser(subparser, func)
+        else:
+            subparser.add_parser(func)
+
+    return parser
 
-for _func in _functions:
-    _def_parser(_func)
+
+def _check_connection_args(parser, args):
+    """Exit with usage error if neither vCenter nor list of them is set."""
+    if not hasattr(args, 'vcenters') or args.vcenters:
+        return
+
+    missing = ['-{short_flag}/--{long_flag}'.format(**_func_args[name])
+               for name in _connection_params if not getattr(args, name)]
+    if missing:
+        parser.func_parsers[args.command].error(
+            'the following arguments are required: {args} or '
+            '-V/--vcenters'.format(args=', '.join(missing)))
+
+
+_parsers = {}  # parsers built for subcommands, None key is for the full one
+
+
+def _parse_args(argv):
+    """Return parsed arguments, only the chosen subcommand is set up."""
+    func_name = argv[0] if argv and argv[0] in _functions else None
+    if func_name not in _parsers:
+        _parsers[func_name] = _build_parser(func_name)
+    args = _parsers[func_name].parse_args(argv)
+    _check_connection_args(_parsers[func_name], args)
+    return args
 
 
 if __name__ == '__main__':
-    args = _parser.parse_args()
+    _setup_logging()
+    if len(sys.argv) > 1 and sys.argv[1] in _served_funcs and \
+            _env_vars[v_socket]:
+        res = call_server(_env_vars[v_socket], sys.argv[1:])
+        if res is not None:
+            sys.exit(res)
+
     if len(sys.argv) == 1:
-        _parser.print_help()
+        _build_parser().print_help()
         sys.exit(0)
+    args = _parse_args(sys.argv[1:])
+    if not _functions[args.command]['connect']:
+        sys.exit(run_func(args, None))
+
+    soap_stats = None
+    if args.soap_stats:
+        # registered first to be reported after log out
+        soap_stats = SoapStats()
+        atexit.register(soap_stats.report, args.soap_stats)
+
+    if getattr(args, 'vcenters', None):
+        try:
+            sys.exit(run_vcenters(args, soap_stats))
+        except Exception as e:
+            emit(args, 'ERROR: {msg}'.format(msg=e), log.ERROR, type='error',
+                 command=args.command, message=str(e))
+            sys.exit(1)
 
     try:
-        inst = Victl(args.host, args.user, args.password, args.port)
-        res = args.func(args, inst)
+        inst = Victl(args.host, args.user, args.password, args.port,
+                     args.cache, soap_stats, args.session)
     except Exception as e:
-        log.error('ERROR: {msg}'.format(msg=e))
-        res = 1
+        emit(args, 'ERROR: {msg}'.format(msg=e), log.ERROR, type='error',
+             command=args.command, message=str(e))
+        sys.exit(1)
 
-    sys.exit(res)
+    sys.exit(run_func(args, inst))
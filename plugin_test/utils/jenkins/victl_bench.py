@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""Copyright 2016 Mirantis, Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License"); you may
+not use this file except in compliance with the License. You may obtain
+copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+License for the specific language governing permissions and limitations
+under the License.
+"""
+
+import argparse
+import json
+import logging as log
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+log.basicConfig(format='%(message)s', level=log.INFO)
+
+_victl_dir = os.path.dirname(os.path.abspath(__file__))
+_victl = os.path.join(_victl_dir, 'victl.py')
+_fake_vcenter = os.path.join(_victl_dir, 'fake_vcenter.py')
+# Results of scale benchmark which CI compares new runs with
+_baseline = os.path.join(_victl_dir, 'victl_bench_baseline.json')
+
+# Modules which must not be loaded until a subcommand really needs them
+_heavy_modules = ['paramiko', 'pyVim', 'pyVmomi', 'requests']
+
+
+def _percentile(values, percent):
+    """Return percentile of values, values must be sorted."""
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def _time_command(cmd, repeat):
+    """Run command repeat times, return sorted list of durations in ms."""
+    durations = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.call(cmd, stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL, cwd=_victl_dir)
+        durations.append((time.time() - start) * 1000)
+    return sorted(durations)
+
+
+def _loaded_heavy_modules():
+    """Return heavy modules which are loaded by import of victl."""
+    code = 'import sys, victl; print(" ".join(sorted(set(' \
+           'name.split(".")[0] for name in sys.modules) & set({mods}))))' \
+           ''.format(mods=_heavy_modules)
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                  cwd=_victl_dir)
+    return out.decode('utf-8').split()
+
+
+# Scenarios of startup benchmark, none of them connects to vCenter
+_startup_cases = {
+    'python': [sys.executable, '-c', 'pass'],
+    'import': [sys.executable, '-c', 'import victl'],
+    'help': [sys.executable, _victl, '--help'],
+    'subcommand-help': [sys.executable, _victl, 'check-dvs-attached',
+                        '--help'],
+    'argument-error': [sys.executable, _victl, 'check-dvs-attached'],
+}
+
+
+def startup(args):
+    """Return 0 if victl starts fast and does not load heavy modules."""
+    failed = False
+
+    loaded = _loaded_heavy_modules()
+    if loaded:
+        log.error('ERROR: import of victl loads {mods}'.format(
+            mods=', '.join(loaded)))
+        failed = True
+
+    results = {}
+    for name, cmd in sorted(_startup_cases.items()):
+        durations = _time_command(cmd, int(args.repeat))
+        results[name] = {
+            'median_ms': round(_percentile(durations, 50), 1),
+            'p90_ms': round(_percentile(durations, 90), 1),
+        }
+        log.info('{name:<16} median {median_ms:>7} ms  p90 {p90_ms:>7} '
+                 'ms'.format(name=name, **results[name]))
+
+    # interpreter startup is not a part of victl startup
+    base = results['python']['median_ms']
+    for name, result in sorted(results.items()):
+        overhead = result['median_ms'] - base
+        if name != 'python' and overhead > float(args.max_ms):
+            log.error('ERROR: {name} takes {overhead:.1f} ms over bare '
+                      'interpreter, limit is {limit} ms'.format(
+                          name=name, overhead=overhead, limit=args.max_ms))
+            failed = True
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'startup': results, 'heavy_modules': loaded}, output,
+                      indent=2, sort_keys=True)
+
+    return 1 if failed else 0
+
+
+# Commands of scale benchmark, they run against fake vCenter with one
+# cluster of the given size; 'setup' only builds inventory and loads victl
+_scale_cases = {
+    'setup': [],
+    'cluster-list': ['cluster-list'],
+    'check-dvs-attached': ['check-dvs-attached', '-c', 'Cluster1',
+                           '-v', 'dvSwitch1', '-n', 'vmnic1'],
+    'check-portgroup': ['check-portgroup', '-c', 'Cluster1', '-g', 'br100'],
+    'check-datastore': ['check-datastore', '-c', 'Cluster1', '-ds', 'nfs1'],
+    'datastore-list': ['datastore-list', '-c', 'Cluster1'],
+    'dvport-list': ['dvport-list', '-v', 'dvSwitch1'],
+    'perf': ['perf', '-c', 'Cluster1', '-du', '1'],
+}
+
+
+def _run_scale_case(hosts, argv):
+    """Run victl command against fake vCenter with hosts.
+
+    :return: (wall time in ms, SOAP round trips, peak RSS in KB, status)
+    """
+    with tempfile.NamedTemporaryFile(suffix='.json') as stats:
+        cmd = [sys.executable, _fake_vcenter, '--hosts', str(hosts)] + argv
+        if argv:
+            cmd += ['--soap_stats', stats.name]
+        start = time.time()
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, cwd=_victl_dir)
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = (time.time() - start) * 1000
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+        calls = 0
+        if argv:
+            stats.seek(0)
+            methods = json.load(stats)['methods']
+            calls = sum(method['calls'] for method in methods.values())
+    return wall, calls, usage.ru_maxrss, proc.returncode
+
+
+def _compare(results, baseline, tolerance, slack):
+    """Return list of regressions of results against baseline.
+
+    Wall time and RSS are compared over setup, which is the cost of the
+    fake vCenter itself.
+
+    :param tolerance: allowed growth in percent
+    :param slack: dictionary of allowed absolute growth by measure, it
+                  covers the noise of short runs
+    """
+    errors = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None or result['command'] == 'setup':
+            continue
+        if result['round_trips'] > base['round_trips']:
+            errors.append('{key}: {new} SOAP round trips, baseline is '
+                          '{old}'.format(key=key, new=result['round_trips'],
+                                         old=base['round_trips']))
+        for name, unit in (('own_ms', 'ms'), ('own_rss_kb', 'KB')):
+            limit = base[name] * (1 + tolerance / 100.0) + slack[name]
+            if result[name] > limit:
+                errors.append('{key}: {new} {unit} of {name}, baseline is '
+                              '{old} {unit}'.format(key=key, new=result[name],
+                                                    old=base[name],
+                                                    name=name, unit=unit))
+    return errors
+
+
+def scale(args):
+    """Return 0 if victl commands scale no worse than baseline."""
+    sizes = [int(size) for size in args.sizes.split(',')]
+    cases = args.commands.split(',') if args.commands else \
+        sorted(_scale_cases)
+    # setup goes first, it shows the cost of the fake vCenter alone
+    cases = ['setup'] + [name for name in cases if name != 'setup']
+
+    failed = False
+    results = {}
+    for hosts in sizes:
+        for name in cases:
+            runs = []
+            own = []
+            for _ in range(int(args.repeat)):
+                # setup runs right before the command, so changes of machine
+                # load cancel out in their difference
+                setup = _run_scale_case(hosts, []) \
+                    if _scale_cases[name] else None
+                run = _run_scale_case(hosts, _scale_cases[name])
+                runs.append(run)
+                if setup:
+                    own.append((run[0] - setup[0], run[2] - setup[2]))
+            walls = sorted(run[0] for run in runs)
+            result = {
+                'hosts': hosts,
+                'command': name,
+                'wall_ms': round(_percentile(walls, 50), 1),
+                'round_trips': max(run[1] for run in runs),
+                'max_rss_kb': max(run[2] for run in runs),
+                'status': max(run[3] for run in runs),
+            }
+            result['own_ms'] = round(_percentile(
+                sorted(item[0] for item in own), 50), 1) if own else 0.0
+            result['own_rss_kb'] = _percentile(
+                sorted(item[1] for item in own), 50) if own else 0
+            results['{name}@{hosts}'.format(name=name, hosts=hosts)] = result
+            if result['status']:
+                log.error('ERROR: {name} on {hosts} hosts exits with '
+                          '{status}'.format(name=name, hosts=hosts,
+                                            status=result['status']))
+                failed = True
+
+            log.info('{hosts:>6} hosts  {command:<20} {wall_ms:>9} ms '
+                     '({own_ms:>8.1f} ms over setup) {round_trips:>5} calls '
+                     '{rss:>7.1f} MB'.format(
+                         rss=result['max_rss_kb'] / 1024.0, **result))
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            errors = _compare(results, json.load(baseline)['scale'],
+                              float(args.tolerance),
+                              {'own_ms': float(args.slack_ms),
+                               'own_rss_kb': float(args.slack_kb)})
+        for error in errors:
+            log.error('ERROR: {error}'.format(error=error))
+        failed = failed or bool(errors)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'scale': results}, output, indent=2, sort_keys=True)
+
+    return 1 if failed else 0
+
+
+_parser = argparse.ArgumentParser(description='Benchmarks of victl.py')
+_subparser = _parser.add_subparsers()
+
+_startup = _subparser.add_parser(
+    'startup', help='Measure victl startup time without vCenter')
+_startup.add_argument('-r', '--repeat', default=20,
+                      help='How many times every case is run')
+_startup.add_argument('-m', '--max-ms', default=100,
+                      help='Allowed median overhead of a case over bare '
+                           'interpreter startup, in milliseconds')
+_startup.add_argument('-o', '--output',
+                      help='File to save results to as JSON')
+_startup.set_defaults(func=startup)
+
+_scale = _subparser.add_parser(
+    'scale', help='Measure victl commands against fake vCenter of '
+                  'growing size')
+_scale.add_argument('-s', '--sizes', default='10,100,1000,5000',
+                    help='Comma separated numbers of hosts in cluster')
+_scale.add_argument('-c', '--commands',
+                    help='Comma separated commands to run, all of {cases} by '
+                         'default'.format(cases=', '.join(
+                             sorted(_scale_cases))))
+_scale.add_argument('-r', '--repeat', default=3,
+                    help='How many times every command is run')
+_scale.add_argument('-o', '--output',
+                    help='File to save results to as JSON')
+_scale.add_argument('-b', '--baseline', default=_baseline,
+                    help='JSON file with results of previous run, more SOAP '
+                         'round trips or wall time and memory over setup '
+                         'beyond tolerance fail the benchmark; the committed '
+                         'baseline by default, empty string skips the check')
+_scale.add_argument('-t', '--tolerance', default=50,
+                    help='Allowed growth of wall time and peak RSS over '
+                         'setup against baseline, in percent')
+_scale.add_argument('--slack-ms', default=100,
+                    help='Allowed growth of wall time over setup on top of '
+                         'tolerance, in milliseconds')
+_scale.add_argument('--slack-kb', default=4096,
+                    help='Allowed growth of peak RSS over setup on top of '
+                         'tolerance, in KB')
+_scale.set_defaults(func=scale)
+
+
+if __name__ == '__main__':
+    args = _parser.parse_args()
+    if not hasattr(args, 'func'):
+        _parser.print_help()
+        sys.exit(0)
+
+    sys.exit(args.func(args))